@@ -8,7 +8,18 @@ import ta
 import warnings
 import time
 import re 
+import os
+import sys
+import json
+import tempfile
+import threading
+import math
+from multiprocessing import shared_memory
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from quant_kernels import (SWEEP_EMPTY_METRICS, backtest_metrics, crossover_signal, make_process_pool, run_app_function,
+                           simulate_long_only, sweep_jobs, sweep_worker) # 行程池的工作函式 (同目錄的可匯入模組)
 
 warnings.filterwarnings('ignore')
 
@@ -22,14 +33,72 @@ st.set_page_config(
     layout="wide"
 )
 
-# 週期映射：(YFinance Period, YFinance Interval)
+# 週期映射：(YFinance Period, K 線週期)；4h 與 1wk 由較細週期在本地重採樣，不另外下載
 PERIOD_MAP = { 
     "30 分": ("60d", "30m"), 
-    "4 小時": ("1y", "60m"), 
+    "4 小時": ("1y", "4h"), 
     "1 日": ("5y", "1d"), 
     "1 週": ("max", "1wk")
 }
 
+# 本地合成週期 → 來源週期 (上游實際下載的最細序列)
+RESAMPLED_INTERVALS = {"4h": "60m", "1wk": "1d"}
+
+# 本地 OHLCV 列式儲存 (Parquet)：每個 (代碼, K線週期) 一個分區檔，重啟後仍保留已下載的歷史
+DATA_STORE_DIR = os.environ.get("APP_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".market_data"))
+OHLCV_STORE_DIR = os.path.join(DATA_STORE_DIR, "ohlcv")
+
+# 冷啟動 (尚無本地分區) 時的完整下載窗口，之後只做增量更新 (Yahoo 分鐘線有歷史長度上限)
+STORE_BOOTSTRAP_PERIOD = {"30m": "60d", "60m": "730d", "1d": "max"}
+STORE_FRESH_SECONDS = 300 # 最近 5 分鐘內已同步的分區直接使用，不再請求網路
+WARMUP_MAX_WORKERS = 8 # 批次預熱的並行連線上限，避免觸發 Yahoo 限流
+
+CHART_MAX_POINTS = 1500 # 圖表每條軌跡送到瀏覽器的點數上限 (超過時降採樣，縮小顯示區間即恢復完整解析度)
+SYMBOL_SUGGEST_LIMIT = 8 # 代碼輸入框下方的候選建議數量
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024 # 跨 session 共用的圖表 JSON 快取上限，超過時淘汰最久未使用的圖表
+SCAN_MAX_PROCESSES = max(1, min(4, os.cpu_count() or 1)) # 參數掃描等 CPU 密集工作的並行數
+
+# 基本面快照：每個代碼每天只抓一次 info，只保留評級與公司資訊需要的精簡欄位並存到本地
+FUNDAMENTALS_STORE_DIR = os.path.join(DATA_STORE_DIR, "fundamentals")
+FUNDAMENTAL_FIELDS = ('returnOnEquity', 'trailingPE', 'freeCashflow', 'totalCash', 'totalDebt', 'longName', 'shortName', 'currency')
+
+# 融合評分的專家權重與行動門檻 (預設值；可由 --calibrate-fusion 依資產類別校準後存入 FUSION_WEIGHTS_PATH)
+DEFAULT_FUSION_WEIGHTS = {
+    "ma_cross": 3.5,       # 黃金 / 死亡交叉
+    "ma_alignment": 2.0,   # 10 / 50 / 200 多空排列
+    "ma_side": 1.0,        # EMA 10 位於 EMA 50 上 / 下
+    "rsi_extreme": 2.0,    # RSI < 40 / > 60 (反向)
+    "rsi_side": 1.0,       # RSI 50 中軸
+    "macd": 1.5,           # MACD 柱狀圖放大
+    "adx_multiplier": 1.5, # ADX > 25 時 MACD 分數的放大倍數
+    "kline": 1.0,          # 大陽線 / 大陰線
+    "fa": 1.0,             # 基本面標準化分數 (-3 ~ 3) 的權重
+    "strong_threshold": 4.0, # |融合分數| ≥ 此值 → 買進 / 賣出
+    "lean_threshold": 1.0,   # |融合分數| ≥ 此值 → 中性偏買 / 偏賣
+    "max_score": 13.75,      # 信心指數的滿分基準
+}
+FUSION_WEIGHTS_PATH = os.path.join(DATA_STORE_DIR, "fusion_weights.json")
+
+# 背景預抓排程：依各市場交易時段在 K 線收完後主動更新熱門標的
+PREFETCH_ENABLED = os.environ.get("PREFETCH_SCHEDULER", "1") == "1"
+PREFETCH_MAX_WORKERS = 4
+PREFETCH_POLL_SECONDS = 60
+PREFETCH_SETTLE_SECONDS = 90 # K 線收完後等待上游發布的緩衝時間
+PREFETCH_RETRY_BASE_SECONDS = 60 # 抓取失敗後的重試間隔 (之後每次失敗加倍)
+PREFETCH_RETRY_MAX_SECONDS = 6 * 3600 # 重試間隔上限 (下市或代碼錯誤的標的最多每 6 小時試一次)
+
+# 交易時段：(時區, 開盤小時, 收盤小時)；加密貨幣為 24/7，不在此表中
+MARKET_SESSIONS = {
+    "TW": ("Asia/Taipei", 9.0, 13.5),
+    "US": ("America/New_York", 9.5, 16.0),
+}
+INTERVAL_SECONDS = {"30m": 1800, "60m": 3600, "4h": 14400, "1d": 86400, "1wk": 604800}
+
+# 行情數據源：yahoo (線上) 或 replay (離線重播本地錄製的 fixture，供效能分析/壓力測試)
+MARKET_DATA_PROVIDER = os.environ.get("MARKET_DATA_PROVIDER", "yahoo")
+REPLAY_FIXTURE_DIR = os.environ.get("REPLAY_FIXTURE_DIR", os.path.join(DATA_STORE_DIR, "fixtures"))
+REPLAY_LATENCY_MS = float(os.environ.get("REPLAY_LATENCY_MS", "0"))
+
 # 🚀 您的【所有資產清單】
 FULL_SYMBOLS_MAP = {
     # ----------------------------------------------------
@@ -126,47 +195,669 @@ for category, codes in CATEGORY_MAP.items():
     CATEGORY_HOT_OPTIONS[category] = options
     
 # ==============================================================================
-# 2. 輔助函式定義
+# 2. 行情數據源 (Market Data Provider)
+# ==============================================================================
+
+def _safe_symbol(symbol):
+    return re.sub(r'[^0-9A-Za-z._-]', '_', symbol)
+
+class MarketDataProvider:
+    """行情數據源介面：所有 K 線與基本面請求都經由此層，分析程式碼不直接依賴特定供應商。"""
+    name = "base"
+
+    def history(self, symbol, interval, period=None, start=None):
+        """回傳 YFinance 格式的原始 K 線 (指定 start 時為增量請求，否則依 period 請求)。"""
+        raise NotImplementedError
+
+    def info(self, symbol):
+        """回傳基本面 info 字典 (欄位名稱與 yf.Ticker.info 相同)。"""
+        raise NotImplementedError
+
+class YahooProvider(MarketDataProvider):
+    name = "yahoo"
+
+    def history(self, symbol, interval, period=None, start=None):
+        ticker = yf.Ticker(symbol)
+        if start is not None: return ticker.history(start=start, interval=interval)
+        return ticker.history(period=period, interval=interval)
+
+    def info(self, symbol):
+        return yf.Ticker(symbol).info
+
+class ReplayProvider(MarketDataProvider):
+    """
+    離線重播數據源：從本地 fixture 讀取錄製好的 K 線 (Parquet) 與 info (JSON)。
+    period 以 fixture 最後一根 K 線為基準截取，確保每次基準測試的數據完全相同；latency 可注入模擬網路延遲 (秒)。
+    """
+    name = "replay"
+
+    def __init__(self, fixture_dir, latency=0.0):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+
+    def _simulate_latency(self):
+        if self.latency > 0: time.sleep(self.latency)
+
+    def history(self, symbol, interval, period=None, start=None):
+        self._simulate_latency()
+        path = os.path.join(self.fixture_dir, "ohlcv", interval, f"{_safe_symbol(symbol)}.parquet")
+        if not os.path.exists(path): return pd.DataFrame()
+        
+        df = pd.read_parquet(path)
+        if df.empty: return df
+        if start is not None: return df[df.index >= start]
+        
+        delta = _period_to_timedelta(period)
+        if delta is not None: df = df[df.index >= df.index[-1] - delta]
+        return df
+
+    def info(self, symbol):
+        self._simulate_latency()
+        path = os.path.join(self.fixture_dir, "info", f"{_safe_symbol(symbol)}.json")
+        if not os.path.exists(path): raise KeyError(f"找不到 {symbol} 的 info fixture")
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+@st.cache_resource
+def get_data_provider():
+    """依 MARKET_DATA_PROVIDER 建立全域共用的數據源 (跨 session 共用同一實例)。"""
+    if MARKET_DATA_PROVIDER == "replay":
+        return ReplayProvider(REPLAY_FIXTURE_DIR, latency=REPLAY_LATENCY_MS / 1000)
+    return YahooProvider()
+
+# ==============================================================================
+# 2.1 請求合併 (Single-Flight)
+# ==============================================================================
+
+class _FlightCall:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    行程內的請求合併：同一個 key 同時只會執行一次抓取，其餘並行呼叫者等待並共用同一結果 (或同一例外)。
+    executed / coalesced 分別記錄實際執行與被合併的呼叫次數。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _FlightCall()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None: raise call.error
+            return call.result
+        
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+@st.cache_resource
+def get_single_flight(name):
+    """跨 session 共用的請求合併器：'ohlcv' 以 (代碼, period, interval) 為 key，'fundamentals' 以代碼為 key。"""
+    return SingleFlight()
+
+def fetch_symbol_info(symbol):
+    """經由請求合併層抓取完整的基本面 info，同一代碼的並行請求只會打一次上游。"""
+    return get_single_flight("fundamentals").do(symbol, get_data_provider().info, symbol)
+
+@st.cache_resource
+def get_fundamentals_cache():
+    """跨 session 共用的基本面快照 (記憶體層)：{代碼: 快照}。"""
+    return {}
+
+def _fundamentals_path(symbol):
+    return os.path.join(FUNDAMENTALS_STORE_DIR, get_data_provider().name, f"{_safe_symbol(symbol)}.json")
+
+def _load_fundamentals_file(symbol):
+    path = _fundamentals_path(symbol)
+    if not os.path.exists(path): return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _save_fundamentals_file(symbol, snapshot):
+    path = _fundamentals_path(symbol)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def get_fundamentals_snapshot(symbol, refresh=False):
+    """
+    基本面快照：{"fetched_date", "fetched_at", "data": 精簡欄位}。當天已抓過就直接使用 (記憶體 → 本地檔案)，
+    否則經由請求合併層抓一次 info 並只保留 FUNDAMENTAL_FIELDS；get_company_info 與 calculate_fundamental_rating 共用。
+    抓取失敗時拋出例外 (不寫入快照)。
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    cache = get_fundamentals_cache()
+    
+    if not refresh:
+        snapshot = cache.get(symbol) or _load_fundamentals_file(symbol)
+        if snapshot is not None and snapshot.get("fetched_date") == today:
+            cache[symbol] = snapshot
+            return snapshot
+    
+    info = fetch_symbol_info(symbol)
+    snapshot = {
+        "fetched_date": today,
+        "fetched_at": time.time(),
+        "data": {field: info[field] for field in FUNDAMENTAL_FIELDS if info.get(field) is not None},
+    }
+    _save_fundamentals_file(symbol, snapshot)
+    cache[symbol] = snapshot
+    return snapshot
+
+def record_replay_fixture(symbol, fixture_dir=REPLAY_FIXTURE_DIR, intervals=None):
+    """從 Yahoo 錄製一個代碼的原始 K 線與 info，供 ReplayProvider 離線重播。"""
+    source = YahooProvider()
+    for interval in (intervals or STORE_BOOTSTRAP_PERIOD.keys()):
+        df = source.history(symbol, interval, period=STORE_BOOTSTRAP_PERIOD.get(interval, "max"))
+        if df.empty: continue
+        path = os.path.join(fixture_dir, "ohlcv", interval, f"{_safe_symbol(symbol)}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path)
+    
+    path = os.path.join(fixture_dir, "info", f"{_safe_symbol(symbol)}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(source.info(symbol), f, ensure_ascii=False, default=str)
+
+# ==============================================================================
+# 3. 輔助函式定義
 # ==============================================================================
 
+class CompactOHLCV:
+    """
+    精簡的 K 線/指標容器：價格與指標欄位存放在單一連續的 float32 緩衝區 (每欄一列，欄內連續)，
+    成交量另存為 float64 陣列 (float32 只能精確表示到 2^24 ≈ 1,677 萬，台股 ETF 與加密貨幣的成交量經常超過)，
+    時間索引存為 int64 epoch (ns) 並另記時區。column() 與 to_frame() 的價格區塊皆為原陣列的視圖，不複製數據，
+    記憶體約為 float64 DataFrame 的一半；用於快取的 K 線與保存在 session_state 的分析結果。
+    """
+    __slots__ = ("values", "volume", "epoch_ns", "columns", "price_columns", "tz")
+
+    def __init__(self, values, epoch_ns, columns, tz=None, volume=None):
+        self.values = values
+        self.volume = volume
+        self.epoch_ns = epoch_ns
+        self.columns = tuple(columns)
+        self.price_columns = tuple(column for column in self.columns if column != 'Volume')
+        self.tz = tz
+
+    @classmethod
+    def from_frame(cls, df):
+        price_columns = [column for column in df.columns if column != 'Volume']
+        values = np.ascontiguousarray(df[price_columns].to_numpy(dtype=np.float32).T)
+        volume = df['Volume'].to_numpy(dtype=np.float64).copy() if 'Volume' in df.columns else None
+        index = pd.DatetimeIndex(df.index)
+        tz = str(index.tz) if index.tz is not None else None
+        return cls(values, index.as_unit('ns').asi8.copy(), df.columns, tz, volume)
+
+    def __len__(self):
+        return len(self.epoch_ns)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.epoch_ns.nbytes + (self.volume.nbytes if self.volume is not None else 0)
+
+    @property
+    def index(self):
+        index = pd.DatetimeIndex(self.epoch_ns.view('M8[ns]'), name='Date')
+        return index.tz_localize('UTC').tz_convert(self.tz) if self.tz else index
+
+    def column(self, name):
+        if name == 'Volume': return self.volume
+        return self.values[self.price_columns.index(name)]
+
+    def to_frame(self):
+        # values.T 為 (時間 × 欄位) 的 Fortran 視圖，pandas 直接以其作為單一 float32 區塊，不會複製；成交量以自己的 float64 區塊插回原位置 (僅此一欄複製)
+        df = pd.DataFrame(self.values.T, index=self.index, columns=list(self.price_columns), copy=False)
+        if self.volume is not None: df.insert(self.columns.index('Volume'), 'Volume', self.volume)
+        return df
+
+def _as_frame(data):
+    """分析與繪圖函式同時接受 DataFrame 或 CompactOHLCV (以零複製視圖讀取)。"""
+    return data if isinstance(data, pd.DataFrame) else data.to_frame()
+
+class SymbolIndex:
+    """
+    代碼查詢索引 (建立一次，之後每次查詢只做雜湊 / 前綴 / n-gram 查表)：
+    - exact：大寫正規化的 代碼 / 關鍵字 → 代碼，名稱則精確比對；優先順序與原本的逐一掃描相同 (先代碼與關鍵字、再名稱，同名取清單中較前者)
+    - 前綴樹：每個節點預先存好依清單順序排列的候選代碼，輸入前綴即可取出建議
+    - 模糊比對：字元 bigram 倒排索引，以 Dice 係數排序 (容許錯字、順序小差異)
+    """
+
+    def __init__(self, symbols_map, max_suggestions=SYMBOL_SUGGEST_LIMIT):
+        self.symbols_map = symbols_map
+        self.max_suggestions = max_suggestions
+        self.exact = {}
+        self.names = {}
+        self._trie = {"": []}
+        self._terms = []  # [(正規化詞, 代碼, bigram 數)]
+        self._grams = {}  # bigram → [詞編號]
+        
+        for code, data in symbols_map.items():
+            self.exact.setdefault(code, code)
+            for kw in data["keywords"]: self.exact.setdefault(kw.upper(), code)
+        for code, data in symbols_map.items():
+            self.names.setdefault(data["name"], code)
+        
+        for code, data in symbols_map.items():
+            for term in dict.fromkeys(t.strip().upper() for t in [code, data["name"], *data["keywords"]]):
+                if term: self._add_term(term, code)
+
+    @staticmethod
+    def _bigrams(term):
+        padded = f" {term} "
+        return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+    def _add_term(self, term, code):
+        node = self._trie
+        for ch in term:
+            node = node.setdefault(ch, {"": []})
+            if code not in node[""] and len(node[""]) < self.max_suggestions: node[""].append(code)
+        
+        grams = self._bigrams(term)
+        term_id = len(self._terms)
+        self._terms.append((term, code, len(grams)))
+        for gram in grams: self._grams.setdefault(gram, []).append(term_id)
+
+    def resolve(self, query):
+        """精確比對代碼 / 關鍵字 / 名稱，找不到時回傳 None。"""
+        query = query.strip()
+        return self.exact.get(query.upper()) or self.names.get(query)
+
+    def prefix(self, query, limit=SYMBOL_SUGGEST_LIMIT):
+        node = self._trie
+        for ch in query.strip().upper():
+            node = node.get(ch)
+            if node is None: return []
+        return node[""][:limit] if node is not self._trie else []
+
+    def fuzzy(self, query, limit=SYMBOL_SUGGEST_LIMIT, min_score=0.5):
+        """bigram Dice 係數模糊比對：回傳 [(代碼, 分數)]，每個代碼取其最相近的詞。"""
+        grams = self._bigrams(query.strip().upper())
+        overlap = {}
+        for gram in grams:
+            for term_id in self._grams.get(gram, ()): overlap[term_id] = overlap.get(term_id, 0) + 1
+        
+        best = {}
+        for term_id, common in overlap.items():
+            _, code, n_grams = self._terms[term_id]
+            score = 2 * common / (len(grams) + n_grams)
+            if score >= min_score and score > best.get(code, 0): best[code] = score
+        return sorted(best.items(), key=lambda item: -item[1])[:limit]
+
+    def suggest(self, query, limit=SYMBOL_SUGGEST_LIMIT):
+        """輸入框建議：精確命中 → 前綴 → 模糊比對，去重後取前 limit 個代碼。"""
+        if not query.strip(): return []
+        exact = self.resolve(query)
+        candidates = [exact] if exact else []
+        candidates += self.prefix(query, limit)
+        if len(dict.fromkeys(candidates)) < limit: candidates += [code for code, _ in self.fuzzy(query, limit)]
+        return list(dict.fromkeys(candidates))[:limit]
+
+@st.cache_resource
+def get_symbol_index():
+    """跨 session 共用的代碼查詢索引 (Streamlit 每次 rerun 都會重新執行腳本，因此不在模組層建立)。"""
+    return SymbolIndex(FULL_SYMBOLS_MAP)
+
 def get_symbol_from_query(query: str) -> str:
-    """ 🎯 進化後的代碼解析函數：同時檢查 FULL_SYMBOLS_MAP """
+    """ 🎯 進化後的代碼解析函數：同時檢查 FULL_SYMBOLS_MAP (經由預先建立的 SymbolIndex 查表) """
     query = query.strip()
     query_upper = query.upper()
-    for code, data in FULL_SYMBOLS_MAP.items():
-        if query_upper == code: return code
-        if any(query_upper == kw.upper() for kw in data["keywords"]): return code 
-    for code, data in FULL_SYMBOLS_MAP.items():
-        if query == data["name"]: return code
+    code = get_symbol_index().resolve(query)
+    if code: return code
     if re.fullmatch(r'\d{4,6}', query) and not any(ext in query_upper for ext in ['.TW', '.HK', '.SS', '-USD']):
         tw_code = f"{query}.TW"
         if tw_code in FULL_SYMBOLS_MAP: return tw_code
         return tw_code
     return query
 
-@st.cache_data(ttl=3600, show_spinner="正在從 Yahoo Finance 獲取數據...")
-def get_stock_data(symbol, period, interval):
+def _period_to_timedelta(period):
+    """將 YFinance period 字串 (60d, 1y, 5y...) 轉為時間長度；max 回傳 None。"""
+    match = re.fullmatch(r'(\d+)(d|wk|mo|y)', period or "")
+    if not match: return None
+    n, unit = int(match.group(1)), match.group(2)
+    days = {"d": 1, "wk": 7, "mo": 30, "y": 365}[unit] * n
+    return pd.Timedelta(days=days)
+
+def _normalize_ohlcv(df):
+    """統一 YFinance 原始 K 線格式：列名、欄位、去重，並刪除未完成的最後一根 K 線。"""
+    if df is None or df.empty: return pd.DataFrame()
+    
+    # 統一列名格式
+    df.columns = [col.capitalize() for col in df.columns] 
+    df.index.name = 'Date'
+    df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
+    
+    # 確保數據時間戳是唯一的 (防止高頻數據重複)
+    df = df[~df.index.duplicated(keep='first')]
+    # 刪除最後一行（通常是未完成的當前 K 線）
+    df = df.iloc[:-1] 
+    return df
+
+def _store_path(symbol, interval):
+    # 依數據源分開存放，離線重播的數據不會混入線上分區
+    return os.path.join(OHLCV_STORE_DIR, get_data_provider().name, interval, f"{_safe_symbol(symbol)}.parquet")
+
+def load_stored_bars(symbol, interval):
+    """讀取本地已儲存的 K 線分區；不存在或損毀時回傳空表。"""
+    path = _store_path(symbol, interval)
+    if not os.path.exists(path): return pd.DataFrame()
     try:
-        ticker = yf.Ticker(symbol)
-        df = ticker.history(period=period, interval=interval)
-        
-        if df.empty: return pd.DataFrame()
-        
-        # 統一列名格式
-        df.columns = [col.capitalize() for col in df.columns] 
-        df.index.name = 'Date'
-        df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
+        return pd.read_parquet(path)
+    except Exception:
+        return pd.DataFrame()
+
+def save_stored_bars(symbol, interval, df):
+    """以「寫入暫存檔再原子替換」的方式保存分區，避免並行讀取到半寫入的檔案。"""
+    path = _store_path(symbol, interval)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+def _partition_age(symbol, interval):
+    """距離上次成功同步該分區的秒數 (以檔案修改時間記錄)。"""
+    path = _store_path(symbol, interval)
+    if not os.path.exists(path): return float('inf')
+    return time.time() - os.path.getmtime(path)
+
+def _merge_bars(stored, fresh):
+    """合併本地與新抓取的 K 線：時間戳重複時以新數據為準。"""
+    if stored.empty: return fresh
+    if fresh.empty: return stored
+    if fresh.index.tz is not None and stored.index.tz is not None:
+        fresh.index = fresh.index.tz_convert(stored.index.tz)
+    merged = pd.concat([stored, fresh])
+    merged = merged[~merged.index.duplicated(keep='last')]
+    return merged.sort_index()
+
+def _slice_period(df, period):
+    """依請求的 period 以最後一根 K 線為基準截取區間 (本地分區可能保存更長的歷史)。"""
+    delta = _period_to_timedelta(period)
+    if df.empty or delta is None: return df
+    return df[df.index >= df.index[-1] - delta]
+
+def refresh_stored_bars(symbol, interval, max_age=STORE_FRESH_SECONDS):
+    """
+    增量更新本地分區並回傳 (完整 K 線, 是否有新數據)。分區在 max_age 秒內同步過則直接使用本地數據。
+    本地已有分區時只請求最後一根已存 K 線之後的數據；若最後一根已超出 Yahoo 的可回溯範圍，
+    或重疊 K 線的價格不一致 (除權息/分割後的復權調整)，則改為完整重抓並取代本地分區。
+    網路失敗時退回本地已儲存的數據。
+    """
+    stored = load_stored_bars(symbol, interval)
+    if not stored.empty and _partition_age(symbol, interval) < max_age: return stored, False
+    bootstrap_period = STORE_BOOTSTRAP_PERIOD.get(interval, "max")
+    
+    try:
+        provider = get_data_provider()
+        fresh = pd.DataFrame()
+        need_full_fetch = stored.empty
         
-        # 確保數據時間戳是唯一的 (防止高頻數據重複)
-        df = df[~df.index.duplicated(keep='first')]
-        # 刪除最後一行（通常是未完成的當前 K 線）
-        df = df.iloc[:-1] 
+        if not stored.empty:
+            last_ts = stored.index[-1]
+            window = _period_to_timedelta(bootstrap_period)
+            if window is not None and last_ts < pd.Timestamp.now(tz=last_ts.tz) - window:
+                need_full_fetch = True
+            else:
+                fresh = _normalize_ohlcv(provider.history(symbol, interval, start=last_ts))
+                # 重疊的那根 K 線用來檢查歷史是否被重新復權
+                if not fresh.empty and last_ts in fresh.index and not np.isclose(fresh.loc[last_ts, 'Close'], stored['Close'].iloc[-1], rtol=1e-6):
+                    stored, need_full_fetch = pd.DataFrame(), True
         
-        if df.empty: return pd.DataFrame() # 再次檢查是否為空
-        return df
+        if need_full_fetch:
+            fresh = _normalize_ohlcv(provider.history(symbol, interval, period=bootstrap_period))
+    except Exception:
+        return stored, False
+    
+    df = _merge_bars(stored, fresh)
+    if df.empty: return df, False
+    if not stored.empty and len(df) == len(stored) and df.index[-1] == stored.index[-1]:
+        os.utime(_store_path(symbol, interval)) # 記錄同步時間，短時間內不再重複請求
+        return df, False
+    
+    save_stored_bars(symbol, interval, df)
+    return df, True
+
+def resample_ohlcv(df, interval, market):
+    """
+    由較細週期 K 線在本地合成較粗週期 (Open 取首、High 取最高、Low 取最低、Close 取末、Volume 加總)。
+    4h：台股/美股以當日開盤時間為錨點切分，不跨交易日；加密貨幣 24/7 以 UTC 00:00 為錨點。
+    1wk：以當地週一為起點，與 Yahoo 週線一致。
+    """
+    if df.empty: return df
+    
+    if interval == "1wk":
+        keys = df.index.normalize() - pd.to_timedelta(df.index.weekday, unit='D')
+    elif interval == "4h":
+        bucket = pd.Timedelta(hours=4)
+        if market == "CRYPTO":
+            keys = df.index.floor(bucket)
+        else:
+            session_open = df.index.normalize() + pd.Timedelta(hours=MARKET_SESSIONS[market][1])
+            keys = session_open + ((df.index - session_open) // bucket) * bucket
+    else:
+        raise ValueError(f"不支援的重採樣週期: {interval}")
+    
+    resampled = df.groupby(keys).agg({'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'})
+    resampled.index.name = 'Date'
+    return resampled
+
+def _bars_for_period(df, symbol, period, interval):
+    """由來源週期的完整分區取出 (period, interval) 的 K 線：需要時在本地重採樣，再依 period 截取。"""
+    if df.empty: return pd.DataFrame()
+    
+    if RESAMPLED_INTERVALS.get(interval, interval) != interval:
+        # 最後一個合成 K 線通常尚未收完，與直接下載時一樣刪除
+        df = resample_ohlcv(df, interval, get_market_of(symbol)).iloc[:-1]
+    
+    df = _slice_period(df, period)
+    if df.empty: return pd.DataFrame() # 再次檢查是否為空
+    # 快取中只保留單一連續的 float32 價格區塊
+    return CompactOHLCV.from_frame(df).to_frame()
+
+def _load_stock_data(symbol, period, interval):
+    try:
+        df, _ = refresh_stored_bars(symbol, RESAMPLED_INTERVALS.get(interval, interval))
+        return _bars_for_period(df, symbol, period, interval)
     except Exception as e:
         return pd.DataFrame()
 
+@st.cache_data(ttl=3600, show_spinner="正在從 Yahoo Finance 獲取數據...")
+def get_stock_data(symbol, period, interval):
+    # TTL 到期後多個 session 同時請求同一標的時，只有一個實際抓取，其餘共用結果
+    return get_single_flight("ohlcv").do((symbol, period, interval), _load_stock_data, symbol, period, interval)
+
+def warm_category_cache(category_key, period, interval, max_workers=WARMUP_MAX_WORKERS, progress_callback=None):
+    """
+    批次預熱整個 CATEGORY_MAP 類別：以有界執行緒池並行增量更新各代碼的本地分區，
+    完成後逐一呼叫 get_stock_data 填入快取，使首次點選熱門標的即命中快取。
+    (Yahoo 的 K 線介面本身即為逐代碼請求，執行緒池可同時保留各交易所時區與增量起點。)
+    """
+    symbols = CATEGORY_MAP.get(category_key, [])
+    frames, refreshed = load_symbol_frames(symbols, period, interval, max_workers, progress_callback)
+    return {"symbols": len(symbols), "refreshed": refreshed, "loaded": sum(1 for df in frames.values() if not df.empty)}
+
+def load_symbol_frames(symbols, period, interval, max_workers=WARMUP_MAX_WORKERS, progress_callback=None):
+    """以有界執行緒池並行增量同步多個代碼的本地分區，再逐一經由 get_stock_data 讀取。回傳 ({代碼: K 線}, 有新數據的分區數)。"""
+    refreshed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(refresh_stored_bars, symbol, RESAMPLED_INTERVALS.get(interval, interval)) for symbol in symbols]
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                _, changed = future.result()
+                refreshed += int(changed)
+            except Exception:
+                pass
+            if progress_callback: progress_callback(done, len(symbols))
+    
+    # 分區剛同步完成，get_stock_data 會直接讀取本地數據並寫入快取
+    return {symbol: get_stock_data(symbol, period, interval) for symbol in symbols}, refreshed
+
+def get_market_of(symbol):
+    if symbol.endswith(".TW") or symbol.startswith("^TWII"): return "TW"
+    if symbol.endswith("-USD"): return "CRYPTO"
+    return "US"
+
+def _session_boundaries(market, interval, day):
+    """某交易日 (當地午夜) 內所有 K 線完成的時間點：分鐘線為開盤後每根 K 線結束與收盤，日線為收盤，週線為週五收盤。"""
+    _, open_hour, close_hour = MARKET_SESSIONS[market]
+    session_open = day + pd.Timedelta(hours=open_hour)
+    session_close = day + pd.Timedelta(hours=close_hour)
+    if interval == "1d": return [session_close]
+    if interval == "1wk": return [session_close] if day.weekday() == 4 else []
+    
+    bar = pd.Timedelta(seconds=INTERVAL_SECONDS[interval])
+    return list(pd.date_range(session_open + bar, session_close, freq=bar, inclusive="left")) + [session_close]
+
+def last_bar_boundary(market, interval, now=None):
+    """回傳該市場在 now 之前最近一次有新 K 線完成的時間點 (UTC)。"""
+    now = pd.Timestamp.now(tz="UTC") if now is None else now.tz_convert("UTC")
+    
+    if market == "CRYPTO":
+        if interval == "1wk": return now.normalize() - pd.Timedelta(days=now.weekday()) # 週 K 於週一 00:00 UTC 換線
+        return now.floor(pd.Timedelta(seconds=INTERVAL_SECONDS[interval]))
+    
+    local_now = now.tz_convert(MARKET_SESSIONS[market][0])
+    day = local_now.normalize()
+    for _ in range(10): # 往回找最近一個已有 K 線完成的交易日 (週末不開盤，國定假日則視為無新數據)
+        if day.weekday() < 5:
+            finished = [b for b in _session_boundaries(market, interval, day) if b <= local_now]
+            if finished: return finished[-1].tz_convert("UTC")
+        day = (day - pd.Timedelta(days=1)).normalize()
+    return None
+
+class PrefetchScheduler:
+    """
+    背景預抓排程器：定期檢查熱門標的各週期是否有新 K 線完成 (依台股/美股收盤與分鐘線邊界，加密貨幣 24/7)，
+    只更新「自上次同步後有新 K 線」的分區，並在每日收盤後更新基本面。以有界執行緒池控制並行數量。
+    抓取失敗的工作記錄在 failures ({(類型, 代碼, 週期): (連續失敗次數, 下次重試時間)})，以指數退避重試，成功後清除。
+    """
+
+    def __init__(self, symbols, intervals, max_workers=PREFETCH_MAX_WORKERS, poll_seconds=PREFETCH_POLL_SECONDS):
+        self.symbols = list(symbols)
+        self.intervals = list(intervals)
+        self.poll_seconds = poll_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._stop = threading.Event()
+        self._thread = None
+        self.failures = {}
+        self.stats = {"runs": 0, "refreshed": 0, "unchanged": 0, "skipped": 0, "backoff": 0, "errors": 0, "last_run": None}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="prefetch-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.stats["errors"] += 1
+            self._stop.wait(self.poll_seconds)
+
+    def due_jobs(self, now=None):
+        """列出需要更新的 (類型, 代碼, 週期)；上次同步之後尚無新 K 線完成的一律略過。"""
+        now = pd.Timestamp.now(tz="UTC") if now is None else now
+        settled = now - pd.Timedelta(seconds=PREFETCH_SETTLE_SECONDS)
+        fundamentals_cache = get_fundamentals_cache()
+        jobs, skipped = [], 0
+        
+        for symbol in self.symbols:
+            market = get_market_of(symbol)
+            for interval in self.intervals:
+                boundary = last_bar_boundary(market, interval, settled)
+                age = _partition_age(symbol, interval)
+                if boundary is not None and (age == float('inf') or now - pd.Timedelta(seconds=age) < boundary):
+                    jobs.append(("ohlcv", symbol, interval))
+                else:
+                    skipped += 1
+            
+            if market != "CRYPTO" and not symbol.startswith('^'):
+                boundary = last_bar_boundary(market, "1d", settled)
+                snapshot = fundamentals_cache.get(symbol) or _load_fundamentals_file(symbol)
+                if boundary is not None and (snapshot is None or pd.Timestamp(snapshot["fetched_at"], unit='s', tz="UTC") < boundary):
+                    jobs.append(("fundamentals", symbol, None))
+        
+        # 仍在退避期間的失敗工作本輪不執行
+        backing_off = [job for job in jobs if job in self.failures and self.failures[job][1] > now]
+        self.stats["backoff"] += len(backing_off)
+        return [job for job in jobs if job not in backing_off], skipped
+
+    def _record_failure(self, job, now):
+        count = self.failures.get(job, (0, None))[0] + 1
+        delay = min(PREFETCH_RETRY_BASE_SECONDS * 2 ** (count - 1), PREFETCH_RETRY_MAX_SECONDS)
+        self.failures[job] = (count, now + pd.Timedelta(seconds=delay))
+
+    def _run_job(self, kind, symbol, interval):
+        if kind == "fundamentals":
+            get_fundamentals_snapshot(symbol, refresh=True)
+            return True
+        _, changed = refresh_stored_bars(symbol, interval, max_age=0)
+        return changed
+
+    def run_once(self, now=None):
+        now = pd.Timestamp.now(tz="UTC") if now is None else now
+        jobs, skipped = self.due_jobs(now)
+        futures = {self._pool.submit(self._run_job, *job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                self.stats["refreshed" if future.result() else "unchanged"] += 1
+                self.failures.pop(futures[future], None)
+            except Exception:
+                self.stats["errors"] += 1
+                self._record_failure(futures[future], now)
+        self.stats["skipped"] += skipped
+        self.stats["runs"] += 1
+        self.stats["last_run"] = datetime.now()
+        return len(jobs)
+
+@st.cache_resource
+def start_prefetch_scheduler():
+    """整個伺服器行程只啟動一個背景排程器 (涵蓋 CATEGORY_HOT_OPTIONS 所有標的與 PERIOD_MAP 所有來源週期)。"""
+    symbols = [code for options in CATEGORY_HOT_OPTIONS.values() for code in options.values()]
+    intervals = sorted({RESAMPLED_INTERVALS.get(interval, interval) for _, interval in PERIOD_MAP.values()})
+    return PrefetchScheduler(symbols, intervals).start()
+
 @st.cache_data(ttl=3600)
 def get_company_info(symbol):
     info = FULL_SYMBOLS_MAP.get(symbol, {})
@@ -177,8 +868,7 @@ def get_company_info(symbol):
         return {"name": info['name'], "category": category, "currency": currency}
     
     try:
-        ticker = yf.Ticker(symbol)
-        yf_info = ticker.info
+        yf_info = get_fundamentals_snapshot(symbol)["data"]
         name = yf_info.get('longName') or yf_info.get('shortName') or symbol
         currency = yf_info.get('currency') or "USD"
         category = "未分類"
@@ -198,45 +888,361 @@ def get_currency_symbol(symbol):
     elif currency_code == 'HKD': return 'HK$'
     else: return currency_code + ' '
 
-# 核心修正：技術指標計算 - 採用進階設定 (10, 50, 200 EMA & 9期 RSI/MACD/ATR/ADX)
-def calculate_technical_indicators(df):
+# ==============================================================================
+# 3.1 向量化技術指標引擎 (NumPy)
+# ==============================================================================
+# 所有核心運算皆沿 axis 0 (時間) 進行，同時支援 1-D 序列與 2-D (時間 × 標的) 矩陣。
+# 數值定義與 ta 庫一致 (EMA 採 adjust=False、RSI/ATR/ADX 採 Wilder 平滑與 ta 的起始值規則)。
+
+_RECURRENCE_MAX_GAIN = 1e4 # 分塊遞迴中 c^-i 的上限，控制浮點誤差
+
+def _linear_recurrence(b, c):
+    """
+    沿 axis 0 計算 y[0] = b[0]、y[t] = c * y[t-1] + b[t]。
+    以固定長度分塊：塊內用 c 的冪次與 cumsum 一次算完，塊間只需傳遞一個 carry，
+    避免逐筆的 Python 迴圈 (EMA、Wilder 平滑皆為此形式)。
+    """
+    b = np.asarray(b, dtype=np.float64)
+    n = b.shape[0]
+    if n == 0 or c == 0: return b.copy()
+    if c == 1: return np.cumsum(b, axis=0)
     
-    # 進階移動平均線 (MA)
-    df['EMA_10'] = ta.trend.ema_indicator(df['Close'], window=10) # 短線趨勢
-    df['EMA_50'] = ta.trend.ema_indicator(df['Close'], window=50) # 長線趨勢
-    df['EMA_200'] = ta.trend.ema_indicator(df['Close'], window=200) # 濾鏡
+    block = int(max(1, min(n, np.log(_RECURRENCE_MAX_GAIN) / -np.log(c))))
+    n_blocks = -(-n // block)
+    padded = np.zeros((n_blocks * block,) + b.shape[1:])
+    padded[:n] = b
+    blocks = padded.reshape((n_blocks, block) + b.shape[1:])
     
-    # MACD (進階設定: 快線 8, 慢線 17, 信號線 9)
-    macd_instance = ta.trend.MACD(df['Close'], window_fast=8, window_slow=17, window_sign=9)
-    df['MACD_Line'] = macd_instance.macd()
-    df['MACD_Signal'] = macd_instance.macd_signal()
-    df['MACD'] = macd_instance.macd_diff() # MACD 柱狀圖
+    trailing = (1,) * (b.ndim - 1)
+    steps = np.arange(block)
+    decay = (c ** steps).reshape((1, block) + trailing)
+    growth = (c ** -steps).reshape((1, block) + trailing)
+    local = np.cumsum(blocks * growth, axis=1) * decay # 假設塊起點 carry 為 0 的結果
+    
+    carry_in = np.zeros((n_blocks,) + b.shape[1:])
+    block_decay = c ** block
+    for k in range(1, n_blocks):
+        carry_in[k] = local[k - 1, -1] + block_decay * carry_in[k - 1]
     
-    # RSI (進階設定: 週期 9)
-    df['RSI'] = ta.momentum.rsi(df['Close'], window=9)
+    result = local + (c * decay) * carry_in[:, None]
+    return result.reshape((n_blocks * block,) + b.shape[1:])[:n]
+
+def _ewm_mean(x, alpha, min_periods, start=0):
+    """等同 pandas ewm(alpha, adjust=False, min_periods).mean()；start 為第一個有效值的位置 (之前為 NaN)。"""
+    out = np.full(x.shape, np.nan)
+    segment = x[start:]
+    if len(segment) == 0: return out
     
-    # 經典布林通道 (20, 2)
-    df['BB_High'] = ta.volatility.bollinger_hband(df['Close'], window=20, window_dev=2)
-    df['BB_Low'] = ta.volatility.bollinger_lband(df['Close'], window=20, window_dev=2)
+    b = alpha * segment
+    b[0] = segment[0]
+    out[start:] = _linear_recurrence(b, 1.0 - alpha)
+    out[:start + min_periods - 1] = np.nan
+    return out
+
+def _ema(x, span, start=0):
+    return _ewm_mean(x, 2.0 / (span + 1), min_periods=span, start=start)
+
+def _rolling_windows(x, window):
+    return np.lib.stride_tricks.sliding_window_view(x, window, axis=0)
+
+def _rolling_mean_std(x, window):
+    """滾動平均與母體標準差 (ddof=0)，與 pandas rolling(window, min_periods=window) 一致。"""
+    mean, std = np.full(x.shape, np.nan), np.full(x.shape, np.nan)
+    if len(x) < window: return mean, std
+    windows = _rolling_windows(x, window)
+    mean[window - 1:] = windows.mean(axis=-1)
+    std[window - 1:] = windows.std(axis=-1)
+    return mean, std
+
+def _shift(x, periods=1):
+    shifted = np.full(x.shape, np.nan)
+    shifted[periods:] = x[:-periods]
+    return shifted
+
+def _wilder_seeded(values, window, seed_index, seed):
+    """ta 的 Wilder 平滑：在 seed_index 放入初始值，之後 y[t] = y[t-1] * (w-1)/w + values[t]。"""
+    b = values[seed_index:].copy()
+    b[0] = seed
+    return _linear_recurrence(b, (window - 1) / window)
+
+def _true_range(high, low, prev_close):
+    true_range = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+    true_range[0] = high[0] - low[0] # 第一根無前收盤價，與 ta 相同只取高低差
+    return true_range
+
+def _atr(true_range, window):
+    atr = np.zeros(true_range.shape)
+    if len(true_range) < window: return atr
+    atr[window - 1:] = _wilder_seeded(true_range / window, window, window - 1, true_range[:window].mean(axis=0))
+    return atr
+
+def _adx(high, low, prev_close, window):
+    """
+    與 ta.trend.ADXIndicator 相同的起始值與 Wilder 遞迴 (前 2w-1 根為 0，第 2w 根起有值)。
+    不足 2w 根時 ta 會直接拋出 IndexError，這裡則回傳全 0 (與暖機期間的輸出一致)。
+    """
+    n = len(high)
+    adx = np.zeros(high.shape)
+    if n < 2 * window: return adx
+    m = n - (window - 1)
     
-    # ATR (進階設定: 週期 9) - 風險控制的基石
-    df['ATR'] = ta.volatility.average_true_range(df['High'], df['Low'], df['Close'], window=9)
+    directional_range = np.maximum(high, prev_close) - np.minimum(low, prev_close)
+    diff_up = high - _shift(high)
+    diff_down = _shift(low) - low
+    pos = np.where((diff_up > diff_down) & (diff_up > 0), diff_up, 0.0)
+    neg = np.where((diff_down > diff_up) & (diff_down > 0), diff_down, 0.0)
     
-    # ADX (進階設定: 週期 9) - 趨勢強度的濾鏡
-    df['ADX'] = ta.trend.adx(df['High'], df['Low'], df['Close'], window=9)
+    def smoothed(values):
+        out = np.zeros((m,) + high.shape[1:])
+        b = values[window:].copy()
+        b[0] = values[1:window + 1].sum(axis=0)
+        out[:m - 1] = _linear_recurrence(b, 1.0 - 1.0 / window)
+        return out
     
-    # 增加 SMA 20 (用於回測基準)
-    df['SMA_20'] = ta.trend.sma_indicator(df['Close'], window=20) 
+    trs, dip, din = smoothed(directional_range), smoothed(pos), smoothed(neg)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dip_pct = np.where(trs != 0, 100 * dip / trs, 0.0)
+        din_pct = np.where(trs != 0, 100 * din / trs, 0.0)
+        di_sum = dip_pct + din_pct
+        dx = np.where(di_sum != 0, 100 * np.abs((dip_pct - din_pct) / di_sum), 0.0)
     
+    b = dx[window - 1:m - 1] / window
+    b[0] = dx[:window].mean(axis=0)
+    adx[window - 1 + window:] = _linear_recurrence(b, (window - 1) / window)
+    return adx
+
+def _rsi(close, prev_close, window):
+    diff = close - prev_close
+    up = np.where(diff > 0, diff, 0.0)
+    down = np.where(diff < 0, -diff, 0.0)
+    avg_up, avg_down = _ewm_mean(up, 1 / window, window), _ewm_mean(down, 1 / window, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(avg_down == 0, 100.0, 100 - 100 / (1 + avg_up / avg_down))
+
+# ==============================================================================
+# 3.2 按需計算的指標註冊表 (Lazy Indicator Registry)
+# ==============================================================================
+
+class IndicatorSpec:
+    """指標定義：名稱樣式 (含參數)、宣告的輸入 (原始欄位或其他指標名稱樣板) 與計算函式。"""
+    def __init__(self, pattern, inputs, compute):
+        self.pattern = re.compile(pattern)
+        self.inputs = inputs
+        self.compute = compute
+
+def _parse_param(text):
+    return int(text) if text.isdigit() else float(text)
+
+# 計算函式的參數依序為：各輸入的數值，接著是名稱中解析出的參數
+INDICATOR_REGISTRY = [
+    IndicatorSpec(r'PREV_CLOSE', ['Close'], lambda close: _shift(close)),
+    IndicatorSpec(r'EMA_(\d+)', ['Close'], lambda close, n: _ema(close, n)),
+    IndicatorSpec(r'ROLLING_(\d+)', ['Close'], lambda close, n: _rolling_mean_std(close, n)),
+    IndicatorSpec(r'SMA_(\d+)', ['ROLLING_{0}'], lambda rolling, n: rolling[0]),
+    IndicatorSpec(r'STD_(\d+)', ['ROLLING_{0}'], lambda rolling, n: rolling[1]),
+    IndicatorSpec(r'BB_HIGH_(\d+)_(\d+(?:\.\d+)?)', ['ROLLING_{0}'], lambda rolling, n, k: rolling[0] + k * rolling[1]),
+    IndicatorSpec(r'BB_LOW_(\d+)_(\d+(?:\.\d+)?)', ['ROLLING_{0}'], lambda rolling, n, k: rolling[0] - k * rolling[1]),
+    IndicatorSpec(r'MACD_LINE_(\d+)_(\d+)', ['EMA_{0}', 'EMA_{1}'], lambda fast, slow, f, s: fast - slow),
+    # MACD 線自第 slow 根起才有值，信號線 EMA 從該處開始
+    IndicatorSpec(r'MACD_SIGNAL_(\d+)_(\d+)_(\d+)', ['MACD_LINE_{0}_{1}'], lambda line, f, s, g: _ema(line, g, start=s - 1)),
+    IndicatorSpec(r'MACD_DIFF_(\d+)_(\d+)_(\d+)', ['MACD_LINE_{0}_{1}', 'MACD_SIGNAL_{0}_{1}_{2}'], lambda line, signal, f, s, g: line - signal),
+    IndicatorSpec(r'RSI_(\d+)', ['Close', 'PREV_CLOSE'], lambda close, prev_close, n: _rsi(close, prev_close, n)),
+    IndicatorSpec(r'TR', ['High', 'Low', 'PREV_CLOSE'], lambda high, low, prev_close: _true_range(high, low, prev_close)),
+    IndicatorSpec(r'ATR_(\d+)', ['TR'], lambda true_range, n: _atr(true_range, n)),
+    IndicatorSpec(r'ADX_(\d+)', ['High', 'Low', 'PREV_CLOSE'], lambda high, low, prev_close, n: _adx(high, low, prev_close, n)),
+]
+
+# App 既有欄位名稱 → 註冊表名稱
+INDICATOR_ALIASES = {
+    'MACD_Line': 'MACD_LINE_8_17',
+    'MACD_Signal': 'MACD_SIGNAL_8_17_9',
+    'MACD': 'MACD_DIFF_8_17_9',
+    'RSI': 'RSI_9',
+    'BB_High': 'BB_HIGH_20_2',
+    'BB_Low': 'BB_LOW_20_2',
+    'ATR': 'ATR_9',
+    'ADX': 'ADX_9',
+}
+
+# calculate_technical_indicators 輸出的欄位 (順序與原本一致)
+TECHNICAL_INDICATOR_COLUMNS = ['EMA_10', 'EMA_50', 'EMA_200', 'MACD_Line', 'MACD_Signal', 'MACD', 'RSI', 'BB_High', 'BB_Low', 'ATR', 'ADX', 'SMA_20']
+
+class IndicatorEngine:
+    """
+    針對單一份價格數據按需計算指標：只計算被請求的名稱及其相依項，
+    所有結果 (含中間結果) 都在此實例內快取，重複或共用的相依項只算一次。
+    """
+    def __init__(self, high, low, close):
+        self._values = {name: np.asarray(a, dtype=np.float64) for name, a in (('High', high), ('Low', low), ('Close', close))}
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(df['High'].to_numpy(), df['Low'].to_numpy(), df['Close'].to_numpy())
+
+    def get(self, name):
+        name = INDICATOR_ALIASES.get(name, name)
+        if name in self._values: return self._values[name]
+        
+        for spec in INDICATOR_REGISTRY:
+            match = spec.pattern.fullmatch(name)
+            if match:
+                params = [_parse_param(g) for g in match.groups()]
+                inputs = [self.get(template.format(*params)) for template in spec.inputs]
+                self._values[name] = spec.compute(*inputs, *params)
+                return self._values[name]
+        raise KeyError(f"未註冊的指標: {name}")
+
+def compute_indicator_columns(df, names):
+    """只為 df 補上被請求且尚不存在的指標欄位 (例如回測只需 SMA_20 與 EMA_50)。"""
+    missing = [name for name in names if name not in df.columns]
+    if not missing: return df
+    engine = IndicatorEngine.from_frame(df)
+    for name in missing:
+        df[name] = engine.get(name)
     return df
 
+def compute_indicator_arrays(high, low, close):
+    """
+    單次向量化計算 calculate_technical_indicators 的全部欄位，經由註冊表共用中間結果：
+    前收盤價 (RSI/ATR/ADX 共用)、20 期滾動均值 (布林中軌與 SMA_20 共用)。回傳 {欄位: ndarray}，欄位順序與原本一致。
+    """
+    engine = IndicatorEngine(high, low, close)
+    return {column: engine.get(column) for column in TECHNICAL_INDICATOR_COLUMNS}
+
+# ==============================================================================
+# 3.3 跨標的批次計算 (時間 × 標的矩陣)
+# ==============================================================================
+
+def build_price_matrix(frames):
+    """
+    將多個標的的 K 線對齊成 (時間 × 標的) 矩陣：時間軸取所有標的的聯集，
+    上市較晚或休市 (各市場假日不同) 的位置以 NaN 補齊。回傳 (時間索引, 代碼列表, {'High','Low','Close': 2-D ndarray})。
+    """
+    symbols = [symbol for symbol, df in frames.items() if not df.empty]
+    if not symbols: return pd.DatetimeIndex([]), [], {}
+    
+    index = frames[symbols[0]].index
+    for symbol in symbols[1:]:
+        index = index.union(frames[symbol].index)
+    
+    matrices = {}
+    for column in ('High', 'Low', 'Close'):
+        matrices[column] = np.column_stack([frames[symbol][column].reindex(index).to_numpy(dtype=np.float64) for symbol in symbols])
+    return index, symbols, matrices
+
+def calculate_indicators_batch(high, low, close):
+    """
+    批次計算 (時間 × 標的) 矩陣的所有指標欄位，一次向量化呼叫涵蓋所有標的。
+    每一欄的有效值先穩定地上移到頂端 (各標的從第 0 列開始、NaN 補在尾端)，逐欄計算後再放回原位置，
+    因此每個標的的結果與單獨計算其自身序列完全相同，不受其他市場交易日或上市日期影響。回傳 {欄位: 2-D ndarray}。
+    """
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    valid = ~(np.isnan(high) | np.isnan(low) | np.isnan(close))
+    order = np.argsort(~valid, axis=0, kind='stable') # 有效列在前，保持時間順序
+    
+    packed = compute_indicator_arrays(*(np.take_along_axis(a, order, axis=0) for a in (high, low, close)))
+    
+    results = {}
+    for column, packed_values in packed.items():
+        values = np.empty_like(packed_values)
+        np.put_along_axis(values, order, packed_values, axis=0)
+        values[~valid] = np.nan
+        results[column] = values
+    return results
+
+def calculate_category_indicators(frames):
+    """以一次批次計算為多個標的加上指標欄位；frames 為 {代碼: K 線 DataFrame}，回傳同樣以代碼為鍵的結果。"""
+    index, symbols, matrices = build_price_matrix(frames)
+    if not symbols: return {}
+    
+    indicators = calculate_indicators_batch(matrices['High'], matrices['Low'], matrices['Close'])
+    columns = list(indicators.keys())
+    stacked = np.stack([indicators[column] for column in columns], axis=-1) # (時間, 標的, 欄位)
+    
+    results = {}
+    for j, symbol in enumerate(symbols):
+        df = frames[symbol]
+        rows = index.get_indexer(df.index)
+        results[symbol] = pd.concat([df, pd.DataFrame(stacked[rows, j], index=df.index, columns=columns)], axis=1)
+    return results
+
+def load_category_indicators(category_key, period, interval, progress_callback=None):
+    """同步並讀取整個 CATEGORY_MAP 類別的 K 線 (load_symbol_frames)，再以一次批次計算加上指標 (供類別掃描使用)。"""
+    frames, _ = load_symbol_frames(CATEGORY_MAP.get(category_key, []), period, interval, progress_callback=progress_callback)
+    return calculate_category_indicators({symbol: _as_frame(df) for symbol, df in frames.items()})
+
+# 核心修正：技術指標計算 - 採用進階設定 (10, 50, 200 EMA & 9期 RSI/MACD/ATR/ADX)
+def calculate_technical_indicators(df):
+    """以向量化引擎一次算出所有指標欄位：EMA 10/50/200、MACD (8/17/9)、RSI 9、BB (20, 2)、ATR 9、ADX 9、SMA 20。"""
+    
+    indicators = compute_indicator_arrays(df['High'].to_numpy(), df['Low'].to_numpy(), df['Close'].to_numpy())
+    for column, values in indicators.items():
+        df[column] = values
+    
+    return df
+
+def _ta_reference_indicators(df):
+    """以 ta 庫逐一計算的參考結果 (原始實作)，用於驗證向量化引擎的數值等價性。"""
+    reference = pd.DataFrame(index=df.index)
+    reference['EMA_10'] = ta.trend.ema_indicator(df['Close'], window=10)
+    reference['EMA_50'] = ta.trend.ema_indicator(df['Close'], window=50)
+    reference['EMA_200'] = ta.trend.ema_indicator(df['Close'], window=200)
+    macd_instance = ta.trend.MACD(df['Close'], window_fast=8, window_slow=17, window_sign=9)
+    reference['MACD_Line'] = macd_instance.macd()
+    reference['MACD_Signal'] = macd_instance.macd_signal()
+    reference['MACD'] = macd_instance.macd_diff()
+    reference['RSI'] = ta.momentum.rsi(df['Close'], window=9)
+    reference['BB_High'] = ta.volatility.bollinger_hband(df['Close'], window=20, window_dev=2)
+    reference['BB_Low'] = ta.volatility.bollinger_lband(df['Close'], window=20, window_dev=2)
+    reference['ATR'] = ta.volatility.average_true_range(df['High'], df['Low'], df['Close'], window=9)
+    reference['ADX'] = ta.trend.adx(df['High'], df['Low'], df['Close'], window=9)
+    reference['SMA_20'] = ta.trend.sma_indicator(df['Close'], window=20)
+    return reference
+
+def synthetic_ohlcv(n_bars, seed=0, flat_bars=0.05):
+    """
+    離線驗證用的合成 K 線 (對數常態隨機漫步)：不需網路或 fixture。
+    約 flat_bars 比例的 K 線開高低收相同 (零波幅)，用來覆蓋 ATR / ADX 分母為 0 的分支。
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+    open_ = np.concatenate(([close[0]], close[:-1])) * np.exp(rng.normal(0, 0.002, n_bars))
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.005, n_bars)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.005, n_bars)))
+    flat = rng.random(n_bars) < flat_bars
+    open_[flat] = high[flat] = low[flat] = close[flat]
+    return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': rng.integers(1000, 100000, n_bars).astype(float)},
+                        index=pd.date_range("2020-01-01", periods=n_bars, freq="D", name="Date"))
+
+# 合成數據檢查的長度：涵蓋 ADX (2w = 18) 與 EMA 200 的邊界，以及一般長度
+SYNTHETIC_CHECK_LENGTHS = (18, 19, 20, 199, 200, 201, 1000, 5000)
+
+def check_indicator_equivalence(df, rtol=1e-9, atol=1e-9):
+    """
+    數值等價性檢查：比較向量化引擎與 ta 庫在同一份 K 線上的每個欄位。
+    回傳 {欄位: (是否等價, 最大絕對誤差)}；NaN 位置必須完全一致。
+    """
+    source = df[['Open', 'High', 'Low', 'Close', 'Volume']].astype(np.float64)
+    reference = _ta_reference_indicators(source)
+    engine = calculate_technical_indicators(source.copy())
+    
+    report = {}
+    for column in reference.columns:
+        expected, actual = reference[column].to_numpy(dtype=np.float64), engine[column].to_numpy(dtype=np.float64)
+        same_nan = np.array_equal(np.isnan(expected), np.isnan(actual))
+        valid = ~np.isnan(expected)
+        max_error = float(np.max(np.abs(expected[valid] - actual[valid]))) if valid.any() else 0.0
+        report[column] = (same_nan and np.allclose(actual[valid], expected[valid], rtol=rtol, atol=atol), max_error)
+    return report
+
 # get_technical_data_df (維持不變 - 技術指標表格與判讀)
 def get_technical_data_df(df):
     """獲取最新的技術指標數據和AI結論，並根據您的進階原則進行判讀。"""
     
+    df = _as_frame(df)
     if df.empty or len(df) < 200: return pd.DataFrame()
 
-    df_clean = df.dropna().copy()
+    df_clean = df.dropna()
     if df_clean.empty: return pd.DataFrame()
 
     last_row = df_clean.iloc[-1]
@@ -329,90 +1335,452 @@ def get_technical_data_df(df):
     return technical_df
 
 # run_backtest (保留並確認其為量化分析的重要組成部分)
-def run_backtest(df, initial_capital=100000, commission_rate=0.001):
+def run_backtest(df, initial_capital=100000, commission_rate=0.001, fast_window=20, slow_window=50):
     """
-    執行基於 SMA 20 / EMA 50 交叉的簡單回測。
+    執行基於 SMA 20 / EMA 50 交叉的簡單回測 (可由 fast_window / slow_window 調整均線週期)。
     策略: 黃金交叉買入 (做多)，死亡交叉清倉 (賣出)。
     """
     
-    if df.empty or len(df) < 51:
-        return {"total_return": 0, "win_rate": 0, "max_drawdown": 0, "total_trades": 0, "message": "數據不足 (少於 51 週期) 或計算錯誤。"}
-
-    data = df.copy()
+    df = _as_frame(df)
+    min_bars = max(fast_window, slow_window) + 1
+    if df.empty or len(df) < min_bars:
+        return {"total_return": 0, "win_rate": 0, "max_drawdown": 0, "total_trades": 0, "message": f"數據不足 (少於 {min_bars} 週期) 或計算錯誤。"}
+
+    # 只補算回測需要的兩條均線 (已存在則直接沿用)
+    fast_column, slow_column = f'SMA_{fast_window}', f'EMA_{slow_window}'
+    data = compute_indicator_columns(df.copy(), [fast_column, slow_column])
     
     # 黃金/死亡交叉信號
-    data['Prev_MA_State'] = (data['SMA_20'].shift(1) > data['EMA_50'].shift(1))
-    data['Current_MA_State'] = (data['SMA_20'] > data['EMA_50'])
-    data['Signal'] = np.where(
-        (data['Current_MA_State'] == True) & (data['Prev_MA_State'] == False), 1, 0 # Buy
-    )
-    data['Signal'] = np.where(
-        (data['Current_MA_State'] == False) & (data['Prev_MA_State'] == True), -1, data['Signal'] # Sell
-    )
+    data['Signal'] = crossover_signal(data[fast_column].to_numpy(dtype=float), data[slow_column].to_numpy(dtype=float))
     
     data = data.dropna()
     if data.empty: return {"total_return": 0, "win_rate": 0, "max_drawdown": 0, "total_trades": 0, "message": "指標計算後數據不足。"}
 
-    # --- 模擬交易邏輯 ---
-    capital = [initial_capital]
-    position = 0 
-    buy_price = 0
-    trades = []
+    capital, trades, final_capital = simulate_long_only(data['Close'].to_numpy(dtype=float), data['Signal'].to_numpy(), initial_capital, commission_rate)
     
-    for i in range(1, len(data)):
-        current_close = data['Close'].iloc[i]
-        
-        # 1. Buy Signal
-        if data['Signal'].iloc[i] == 1 and position == 0:
-            position = 1
-            buy_price = current_close
-            initial_capital -= initial_capital * commission_rate 
-            
-        # 2. Sell Signal
-        elif data['Signal'].iloc[i] == -1 and position == 1:
-            sell_price = current_close
-            profit = (sell_price - buy_price) / buy_price 
-            
-            trades.append({ 'entry_date': data.index[i], 'exit_date': data.index[i], 'profit_pct': profit, 'is_win': profit > 0 })
-            
-            initial_capital *= (1 + profit)
-            initial_capital -= initial_capital * commission_rate
-            position = 0
-            
-        current_value = initial_capital
-        if position == 1:
-            current_value = initial_capital * (current_close / buy_price)
+    return dict(
+        backtest_metrics(capital, trades, final_capital),
+        message=f"回測區間 {data.index[0].strftime('%Y-%m-%d')} 到 {data.index[-1].strftime('%Y-%m-%d')}。",
+        capital_curve=pd.Series(capital),
+        trades=[{ 'entry_date': data.index[entry], 'exit_date': data.index[exit_], 'entry_price': buy_price, 'exit_price': sell_price, 'profit_pct': profit, 'is_win': profit > 0 }
+                for entry, exit_, buy_price, sell_price, profit in trades],
+    )
+
+# ==============================================================================
+# 均線參數掃描 (共享記憶體 + 多行程)
+# ==============================================================================
+
+@st.cache_resource(validate=lambda pool: not pool._broken)
+def get_compute_pool():
+    """
+    跨 session 共用的行程池 (forkserver / spawn，見 quant_kernels)：參數掃描、Walk-forward 與類別掃描共用。
+    類別掃描的工作第一次執行時在工作行程載入 app2.0.py，之後直接沿用；有工作行程異常結束 (行程池失效) 時下次取用會重建。
+    """
+    return make_process_pool(SCAN_MAX_PROCESSES)
+
+class SweepMatrix:
+    """
+    參數掃描的共享記憶體矩陣：[收盤價, 有效列, 各 SMA..., 各 EMA...]，每個週期的均線只計算一次 (已存在的欄位直接沿用，同 run_backtest)。
+    以 with 區塊管理生命週期；同一次分析 (例如 Walk-forward 的所有視窗) 共用同一份，各視窗只傳遞列範圍。
+    valid 為可交易的列 (預設為 df 所有欄位皆非 NaN，等同 run_backtest 的 dropna)；各組合另外只排除自己兩條均線為 NaN 的列。
+    """
+
+    def __init__(self, df, fast_windows, slow_windows, valid=None):
+        columns = [f'SMA_{fast}' for fast in sorted(set(fast_windows))] + [f'EMA_{slow}' for slow in sorted(set(slow_windows))]
+        engine = IndicatorEngine.from_frame(df)
+        valid = df.notna().all(axis=1) if valid is None else valid
+        rows = [df['Close'].to_numpy(dtype=float), np.asarray(valid, dtype=float)]
+        rows += [df[column].to_numpy(dtype=float) if column in df.columns else engine.get(column) for column in columns]
+        self.row_of = {column: i + 2 for i, column in enumerate(columns)}
+        self.shape = (len(rows), len(df))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(self.shape)) * 8))
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)
+        self.array[:] = np.vstack(rows)
+
+    def jobs(self, combos):
+        return [(self.row_of[f'SMA_{fast}'], self.row_of[f'EMA_{slow}'], rate) for fast, slow, rate in combos]
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _sweep_combos(fast_windows, slow_windows, commission_rates, n_random=None, seed=0):
+    combos = [(fast, slow, rate) for rate in commission_rates for fast in fast_windows for slow in slow_windows if fast < slow]
+    if n_random and n_random < len(combos):
+        picks = np.sort(np.random.default_rng(seed).choice(len(combos), size=n_random, replace=False))
+        combos = [combos[i] for i in picks]
+    return combos
+
+def _run_sweep(shared, combos, pool, initial_capital=100000, start=0, stop=None, check_length=True):
+    """
+    在既有的共享矩陣與行程池上回測 combos (只看第 start ~ stop 根)，回傳結果表。
+    check_length 套用 run_backtest 的最少週期檢查；均線已在完整歷史上算好時 (Walk-forward) 不需要。
+    """
+    n_bars = len(range(shared.shape[1])[start:stop])
+    jobs = shared.jobs(combos)
+    chunk_size = max(1, math.ceil(len(jobs) / (SCAN_MAX_PROCESSES * 4)))
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    metrics = [m for chunk in pool.map(sweep_worker, [shared.shm.name] * len(chunks), [shared.shape] * len(chunks), chunks,
+                                       [initial_capital] * len(chunks), [start] * len(chunks), [stop] * len(chunks)) for m in chunk]
+    
+    results = pd.DataFrame([dict(SWEEP_EMPTY_METRICS if check_length and n_bars < max(fast, slow) + 1 else metrics[k], fast_window=fast, slow_window=slow, commission_rate=rate) # run_backtest 的最少週期檢查
+                            for k, (fast, slow, rate) in enumerate(combos)])
+    return results[['fast_window', 'slow_window', 'commission_rate', 'total_return', 'max_drawdown', 'win_rate', 'total_trades']]
+
+def sweep_ma_parameters(df, fast_windows=range(5, 55, 5), slow_windows=range(20, 210, 10), commission_rates=(0.001,),
+                        n_random=None, initial_capital=100000, seed=0):
+    """
+    SMA (快線) / EMA (慢線) 交叉策略的參數掃描：網格搜尋 (快線 < 慢線 的所有組合)，或指定 n_random 隨機抽樣其中幾組。
+    每個週期的均線只計算一次，連同收盤價放入共享記憶體 (SweepMatrix)，由行程池 (get_compute_pool) 的工作行程各自掛載同一份矩陣回測，
+    每組結果與 run_backtest(df, fast_window=..., slow_window=..., commission_rate=...) 相同。
+    """
+    df = _as_frame(df)
+    combos = _sweep_combos(fast_windows, slow_windows, commission_rates, n_random, seed)
+    if not combos: return pd.DataFrame()
+    
+    with SweepMatrix(df, [fast for fast, _, _ in combos], [slow for _, slow, _ in combos]) as shared:
+        return _run_sweep(shared, combos, get_compute_pool(), initial_capital)
+
+def create_sweep_heatmaps(results, commission_rate):
+    """某個手續費假設下，各 (快線, 慢線) 組合的總回報率 / 最大回撤 / 勝率熱圖。"""
+    subset = results[results['commission_rate'] == commission_rate]
+    fig = make_subplots(rows=1, cols=3, subplot_titles=("總回報率 (%)", "最大回撤 MDD (%)", "勝率 (%)"), horizontal_spacing=0.08)
+    for col, (metric, colorscale) in enumerate([('total_return', 'RdYlGn'), ('max_drawdown', 'RdYlGn_r'), ('win_rate', 'RdYlGn')], start=1):
+        grid = subset.pivot_table(index='slow_window', columns='fast_window', values=metric)
+        fig.add_trace(go.Heatmap(z=grid.to_numpy(), x=[f"SMA {fast}" for fast in grid.columns], y=[f"EMA {slow}" for slow in grid.index],
+                                 colorscale=colorscale, showscale=False, hovertemplate="%{x} / %{y}: %{z:.2f}<extra></extra>"), row=1, col=col)
+    fig.update_layout(margin=dict(l=20, r=20, t=40, b=20), height=450)
+    return fig
+
+# ==============================================================================
+# 回測穩健性分析 (Walk-forward / Monte Carlo)
+# ==============================================================================
+
+def walk_forward_analysis(df, in_sample_bars=500, out_sample_bars=125, fast_windows=range(5, 55, 5), slow_windows=range(20, 210, 20),
+                          commission_rate=0.001):
+    """
+    滾動式樣本內 / 樣本外驗證：每個視窗先在樣本內做均線參數掃描，選出總回報率最高的均線組合，
+    再用該組合回測緊接著的樣本外區段，視窗每次前移 out_sample_bars。
+    均線以完整歷史一次算好，樣本內掃描與樣本外回測都直接使用這些均線 (不重新暖機、不套用 run_backtest 的最少週期檢查)，
+    因此慢線週期長於樣本外區段時仍能正常回測；每組合只排除自己兩條均線尚未有值的列。
+    回傳 (各視窗結果表, 彙總)；彙總的 efficiency = 樣本外平均報酬 / 樣本內平均報酬。
+    """
+    df = _as_frame(df)
+    data = compute_indicator_columns(df.copy(), [f'SMA_{fast}' for fast in fast_windows] + [f'EMA_{slow}' for slow in slow_windows])
+    combos = _sweep_combos(fast_windows, slow_windows, (commission_rate,))
+    
+    windows = []
+    # 整個分析共用一份共享矩陣 (行程池本身跨 session 共用)，各視窗只傳遞列範圍
+    pool = get_compute_pool()
+    with SweepMatrix(data, fast_windows, slow_windows, valid=data['Close'].notna()) as shared:
+        for is_start in range(0, len(data) - in_sample_bars - out_sample_bars + 1, out_sample_bars) if combos else ():
+            oos_start, oos_stop = is_start + in_sample_bars, is_start + in_sample_bars + out_sample_bars
+            in_sample, out_sample = data.iloc[is_start:oos_start], data.iloc[oos_start:oos_stop]
             
-        capital.append(current_value)
+            sweep = _run_sweep(shared, combos, pool, start=is_start, stop=oos_start, check_length=False)
+            best = sweep.sort_values('total_return', ascending=False, kind='stable').iloc[0]
+            best_combo = (int(best['fast_window']), int(best['slow_window']), commission_rate)
+            oos = sweep_jobs(shared.array, shared.jobs([best_combo]), 100000, start=oos_start, stop=oos_stop)[0]
+            windows.append({
+                "is_start": in_sample.index[0], "is_end": in_sample.index[-1], "oos_start": out_sample.index[0], "oos_end": out_sample.index[-1],
+                "fast_window": int(best['fast_window']), "slow_window": int(best['slow_window']),
+                "is_return": best['total_return'], "oos_return": oos['total_return'], "oos_max_drawdown": oos['max_drawdown'], "oos_trades": oos['total_trades'],
+            })
+    
+    results = pd.DataFrame(windows)
+    if results.empty: return results, {"windows": 0, "oos_compound_return": 0, "oos_win_windows": 0, "efficiency": np.nan}
+    
+    mean_is = results['is_return'].mean()
+    return results, {
+        "windows": len(results),
+        "oos_compound_return": round((np.prod(1 + results['oos_return'].to_numpy() / 100) - 1) * 100, 2), # 各樣本外區段串接
+        "oos_win_windows": int((results['oos_return'] > 0).sum()),
+        "efficiency": round(results['oos_return'].mean() / mean_is, 2) if mean_is > 0 else np.nan,
+    }
+
+def monte_carlo_trades(trades, n_paths=5000, commission_rate=0.001, initial_capital=100000, seed=0):
+    """
+    交易序列的 Monte Carlo 重抽樣：以放回抽樣一次產生 (n_paths × 交易數) 的報酬矩陣，
+    每筆交易的資金乘數 = (1 - 手續費) × (1 + 報酬) × (1 - 手續費)，沿 axis 1 累乘即為所有路徑的逐筆資金曲線。
+    回撤以逐筆 (平倉時) 資金計算，不含持倉期間的浮動回撤。
+    """
+    profits = np.array([trade['profit_pct'] for trade in trades], dtype=float)
+    if profits.size == 0: return None
+    
+    rng = np.random.default_rng(seed)
+    multipliers = ((1 - commission_rate) * (1 + profits) * (1 - commission_rate))[rng.integers(0, profits.size, size=(n_paths, profits.size))]
+    equity = initial_capital * np.cumprod(np.hstack([np.ones((n_paths, 1)), multipliers]), axis=1)
+    
+    returns = (equity[:, -1] / initial_capital - 1) * 100
+    peaks = np.maximum.accumulate(equity, axis=1)
+    max_drawdowns = ((peaks - equity) / peaks).max(axis=1) * 100
+    
+    quantiles = [5, 25, 50, 75, 95]
+    return {
+        "returns": returns,
+        "max_drawdowns": max_drawdowns,
+        "equity": equity,
+        "percentiles": pd.DataFrame({"總回報率 (%)": np.percentile(returns, quantiles), "最大回撤 (%)": np.percentile(max_drawdowns, quantiles)},
+                                    index=[f"P{q}" for q in quantiles]).round(2),
+        "loss_probability": round(float((returns < 0).mean() * 100), 2),
+    }
+
+# ==============================================================================
+# 投資組合回測 (多標的 × 跨市場行事曆)
+# ==============================================================================
+
+PORTFOLIO_REBALANCE_RULES = {"每日": "D", "每週": "W", "每月": "M", "每季": "Q", "不再平衡": None}
+
+def crossover_positions(df, fast_window=20, slow_window=50):
+    """SMA / EMA 交叉策略的逐 K 線持倉 (1 = 持有、0 = 空手)，進出場規則與 run_backtest 相同。"""
+    df = _as_frame(df)
+    data = compute_indicator_columns(df[['High', 'Low', 'Close']].copy(), [f'SMA_{fast_window}', f'EMA_{slow_window}'])
+    fast_ma, slow_ma = data[f'SMA_{fast_window}'].to_numpy(dtype=float), data[f'EMA_{slow_window}'].to_numpy(dtype=float)
+    signal = crossover_signal(fast_ma, slow_ma).astype(float)
+    signal[np.isnan(_shift(fast_ma, 1)) | np.isnan(_shift(slow_ma, 1))] = 0 # 均線剛出現的第一根 (run_backtest 中 dropna 後的第 0 根) 不交易
+    state = pd.Series(np.where(signal == 0, np.nan, signal), index=df.index).ffill()
+    return (state == 1).astype(float)
+
+def _calendar_index(index):
+    """日線以上以各市場的當地日期對齊 (台股、美股、加密貨幣的同一天落在同一列)，分鐘線則統一換成 UTC 時間。"""
+    if len(index) and (index == index.normalize()).all():
+        return pd.DatetimeIndex(index.tz_localize(None) if index.tz is not None else index)
+    return index.tz_convert("UTC") if index.tz is not None else index
+
+def run_portfolio_backtest(frames, positions=None, weighting="equal", rebalance="M", commission_rate=0.001,
+                           initial_capital=100000, vol_window=20):
+    """
+    多標的投資組合回測。frames = {代碼: K 線}，positions = {代碼: 逐 K 線持倉 (0~1)}，未提供時使用 SMA 20 / EMA 50 交叉。
+    各標的依自己的交易日曆計算，再以 _calendar_index 對齊到聯集時間軸：休市日價格與持倉沿用前值 (報酬為 0)，上市前權重為 0。
+    每個再平衡點把資金分配給當時已上市的標的 (weighting = "equal" 等權重 / "volatility" 反波動率權重)，
+    每個標的的子帳戶在持倉為 0 時保留現金；兩次再平衡之間權重隨價格漂移。
+    淨值、回撤與換手率皆以 (時間 × 標的) 矩陣一次計算：期間內的子帳戶淨值 = 期初權重 × 累積報酬比值，
+    各期期末比值累乘即為再平衡點的淨值。手續費依每根 K 線的換手率按比例自總淨值扣除。
+    """
+    frames = {symbol: _as_frame(df) for symbol, df in frames.items() if not _as_frame(df).empty}
+    if not frames: return None
+    symbols = list(frames)
+    positions = positions or {symbol: crossover_positions(df) for symbol, df in frames.items()}
+    
+    aligned = {symbol: df.set_axis(_calendar_index(df.index)) for symbol, df in frames.items()}
+    aligned = {symbol: df[~df.index.duplicated(keep='last')] for symbol, df in aligned.items()}
+    index = aligned[symbols[0]].index
+    for symbol in symbols[1:]:
+        index = index.union(aligned[symbol].index)
+    
+    def to_matrix(series_of):
+        return np.column_stack([series_of(symbol).reindex(index).ffill().to_numpy(dtype=np.float64) for symbol in symbols])
+    
+    close = to_matrix(lambda symbol: aligned[symbol]['Close'])
+    position = np.nan_to_num(to_matrix(lambda symbol: positions[symbol].set_axis(_calendar_index(positions[symbol].index)).groupby(level=0).last()))
+    volatility = to_matrix(lambda symbol: aligned[symbol]['Close'].pct_change().rolling(vol_window).std())
+    listed = ~np.isnan(close)
+    
+    # 逐 K 線報酬：持倉在收盤時變動，因此第 t 根的報酬使用第 t-1 根的持倉
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bar_return = np.nan_to_num(close / _shift(close, 1) - 1)
+    growth = np.cumprod(1 + np.nan_to_num(_shift(position, 1)) * bar_return, axis=0)
+    
+    # 再平衡點 (第一根必定是) 的目標權重
+    rule = PORTFOLIO_REBALANCE_RULES.get(rebalance, rebalance)
+    if rule is None:
+        is_rebalance = np.zeros(len(index), dtype=bool)
+    else:
+        calendar = index.tz_localize(None) if index.tz is not None else index
+        periods = calendar.to_period(rule).asi8 if rule != "D" else calendar.normalize().asi8
+        is_rebalance = np.concatenate(([False], periods[1:] != periods[:-1]))
+    is_rebalance[0] = True
+    rebalance_idx = np.flatnonzero(is_rebalance)
+    
+    if weighting == "volatility":
+        raw = np.where(listed & (volatility > 0), 1 / np.where(volatility > 0, volatility, 1), 0)[rebalance_idx]
+        raw = np.where(raw.sum(axis=1, keepdims=True) > 0, raw, listed[rebalance_idx].astype(float)) # 波動率尚無數據時退回等權重
+    else:
+        raw = listed[rebalance_idx].astype(float)
+    target = np.divide(raw, raw.sum(axis=1, keepdims=True), out=np.zeros_like(raw), where=raw.sum(axis=1, keepdims=True) > 0)
+    
+    # 第 t 根的報酬屬於「t-1 之前最近一次再平衡」的期間
+    period_of = np.searchsorted(rebalance_idx, np.arange(len(index)) - 1, side='right') - 1
+    period_of[0] = 0
+    period_start = rebalance_idx[period_of]
+    weight = target[period_of]
+    relative_growth = growth / growth[period_start]
+    sleeve = weight * relative_growth
+    period_ratio = sleeve.sum(axis=1) + (1 - weight.sum(axis=1))
+    
+    start_value = np.cumprod(np.concatenate(([1.0], period_ratio[rebalance_idx[1:]])))
+    gross = start_value[period_of] * period_ratio
+    
+    # 換手率 (占總淨值比例)：持倉變動時買賣該子帳戶，再平衡時調整持有中的子帳戶至目標權重
+    drifted = np.divide(sleeve, period_ratio[:, None], out=np.zeros_like(sleeve), where=period_ratio[:, None] > 0)
+    turnover = (np.abs(np.diff(position, axis=0, prepend=0)) * drifted).sum(axis=1)
+    turnover[rebalance_idx[1:]] += (position[rebalance_idx[1:]] * np.abs(target[1:] - drifted[rebalance_idx[1:]])).sum(axis=1)
+    
+    equity = initial_capital * gross * np.cumprod(1 - commission_rate * turnover)
+    peak = np.maximum.accumulate(equity)
+    drawdown = (equity - peak) / peak
+    
+    years = max((index[-1] - index[0]).days / 365.25, 1 / 365.25)
+    return {
+        "total_return": round((equity[-1] / initial_capital - 1) * 100, 2),
+        "max_drawdown": round(abs(drawdown.min()) * 100, 2),
+        "annual_turnover": round(turnover.sum() / years * 100, 2),
+        "rebalances": len(rebalance_idx),
+        "equity": pd.Series(equity, index=index),
+        "drawdown": pd.Series(drawdown * 100, index=index),
+        "turnover": pd.Series(turnover, index=index),
+        "weights": pd.DataFrame(drifted, index=index, columns=symbols),
+    }
+
+# ==============================================================================
+# 融合策略 ATR 停利 / 停損回測 (事件驅動 + 向量化首次觸價)
+# ==============================================================================
+
+def _first_touch(hit):
+    """每列第一個 True 的位置；整列都沒有時回傳列長 (表示未觸價)。"""
+    return np.where(hit.any(axis=1), hit.argmax(axis=1), hit.shape[1])
 
-    # 3. Handle open position
-    if position == 1:
-        sell_price = data['Close'].iloc[-1]
-        profit = (sell_price - buy_price) / buy_price
+def _refine_intrabar(sub_bars, direction, take_profit, stop_loss, entry=None):
+    """
+    以較細的 K 線 (例如 30 分) 判斷同一根 K 線內停利與停損的先後；entry 不為 None 時先找進場成交的子 K 線。
+    回傳 ("TP" / "SL", 觸價的子 K 線時間)；無法判斷 (沒有細 K 線或未觸價) 時回傳 None。
+    """
+    if sub_bars.empty: return None
+    high, low = sub_bars['High'].to_numpy(dtype=float), sub_bars['Low'].to_numpy(dtype=float)
+    start = 0
+    if entry is not None:
+        filled = (low <= entry) if direction == 1 else (high >= entry)
+        if not filled.any(): return None
+        start = int(filled.argmax())
+    high, low = high[start:], low[start:]
+    tp_hit = (high >= take_profit) if direction == 1 else (low <= take_profit)
+    sl_hit = (low <= stop_loss) if direction == 1 else (high >= stop_loss)
+    tp_first = int(tp_hit.argmax()) if tp_hit.any() else len(high)
+    sl_first = int(sl_hit.argmax()) if sl_hit.any() else len(high)
+    if tp_first == sl_first == len(high): return None
+    return ("SL", sub_bars.index[start + sl_first]) if sl_first <= tp_first else ("TP", sub_bars.index[start + tp_first])
+
+def run_bracket_backtest(df, fa_rating, commission_rate=0.001, entry_expiry_bars=3, max_holding_bars=60, refine_bars=None, weights=None):
+    """
+    回放 generate_fusion_signal_series 的逐 K 線行動與 ATR 掛單：空手時，偏多 (偏空) 行動在收盤後掛出進場限價單
+    (Entry_Price，entry_expiry_bars 根內未成交則取消)，成交後同時掛上 Take_Profit / Stop_Loss，
+    以 High / Low 判斷觸價，max_holding_bars 根內都未觸價則以收盤價時間出場。空手期間每個信號各自掛單，最先成交的一張成為部位 (其餘取消)。
+    所有候選信號的成交與首次觸價位置以 sliding_window_view 一次向量化算出，之後只需逐筆交易 (而非逐根 K 線) 串接不重疊的部位。
+    先後未知的 K 線有兩種，未能判斷時的預設處理：
+    - 進場當根觸及停利：無法確定觸價在成交之前或之後，保守忽略 (停利從下一根才開始計；當根同時觸及停損則以停損出場)
+    - 之後某根同時觸及停利與停損：保守視為停損
+    若提供 refine_bars (例如本地 30 分 K)，每一根先後未知的 K 線都以其時間範圍內的細 K 線判斷先後。跳空越過價位時以開盤價成交 (進場當根開盤已越過停損則以開盤價停損)。
+    """
+    df = _as_frame(df).dropna()
+    signals = generate_fusion_signal_series(df, fa_rating, weights)
+    n = len(df)
+    if n < 3: return None
+    
+    open_, high, low, close = (df[column].to_numpy(dtype=float) for column in ('Open', 'High', 'Low', 'Close'))
+    direction = signals['Signal'].to_numpy()
+    entry_level, take_profit, stop_loss = (signals[column].to_numpy(dtype=float) for column in ('Entry_Price', 'Take_Profit', 'Stop_Loss'))
+    
+    # 1. 進場限價單：信號後 entry_expiry_bars 根內第一根觸及進場價的 K 線
+    candidates = np.flatnonzero((direction != 0) & ~np.isnan(entry_level))
+    candidates = candidates[candidates < n - 1]
+    width = max(entry_expiry_bars, max_holding_bars) # 同一組視窗同時供掛單期與持倉期切片
+    padded_high = np.concatenate((high, np.full(width, np.nan)))
+    padded_low = np.concatenate((low, np.full(width, np.nan)))
+    high_windows = np.lib.stride_tricks.sliding_window_view(padded_high, width)
+    low_windows = np.lib.stride_tricks.sliding_window_view(padded_low, width)
+    
+    side = direction[candidates][:, None]
+    fill_hit = np.where(side == 1, low_windows[candidates + 1, :entry_expiry_bars] <= entry_level[candidates][:, None],
+                        high_windows[candidates + 1, :entry_expiry_bars] >= entry_level[candidates][:, None])
+    fill_offset = _first_touch(fill_hit)
+    filled = fill_offset < entry_expiry_bars
+    candidates, side, fill_offset = candidates[filled], side[filled], fill_offset[filled]
+    fill_index = candidates + 1 + fill_offset
+    
+    # 2. 停利 / 停損首次觸價 (進場當根只計停損；停利從下一根開始計)
+    window_high, window_low = high_windows[fill_index, :max_holding_bars], low_windows[fill_index, :max_holding_bars]
+    tp_level, sl_level = take_profit[candidates][:, None], stop_loss[candidates][:, None]
+    tp_hit = np.where(side == 1, window_high >= tp_level, window_low <= tp_level)
+    sl_hit = np.where(side == 1, window_low <= sl_level, window_high >= sl_level)
+    fill_bar_tp = tp_hit[:, 0].copy()
+    tp_hit[:, 0] = False
+    tp_first, sl_first = _first_touch(tp_hit), _first_touch(sl_hit)
+    exit_offset = np.minimum(tp_first, sl_first)
+    is_timeout = exit_offset >= max_holding_bars
+    exit_offset = np.where(is_timeout, np.minimum(max_holding_bars - 1, n - 1 - fill_index), exit_offset)
+    reason = np.where(is_timeout, "TIME", np.where(sl_first <= tp_first, "SL", "TP")).astype(object)
+    reason[is_timeout & (fill_index + max_holding_bars > n)] = "END"
+    exit_tie = ~is_timeout & (tp_first == sl_first)
+    
+    # 3. 串接不重疊的部位：出場當根收盤後才會再掛新單，之後的掛單中最先成交者 (同時成交取較早的信號) 成為下一筆 (逐筆交易，不逐根 K 線)
+    # next_fill[k] = candidates[k:] 中成交位置最早者的位置，以 (成交位置, 信號順序) 合成的鍵由後往前取最小值
+    order_key = fill_index.astype(np.int64) * max(len(candidates), 1) + np.arange(len(candidates))
+    next_fill = np.minimum.accumulate(order_key[::-1])[::-1] % max(len(candidates), 1)
+    bar_end = df.index[1:].append(pd.DatetimeIndex([df.index[-1] + (df.index[-1] - df.index[-2])]))
+    def sub_bars_of(i):
+        return refine_bars[(refine_bars.index >= df.index[i]) & (refine_bars.index < bar_end[i])]
+    
+    trades, k, refined = [], int(next_fill[0]) if len(candidates) else 0, 0
+    while k < len(candidates):
+        t, j, d = candidates[k], fill_index[k], int(side[k, 0])
+        exit_index, exit_reason = j + exit_offset[k], reason[k]
+        exit_time, ambiguous_bars = None, 0
         
-        trades.append({ 'entry_date': data.index[-1], 'exit_date': data.index[-1], 'profit_pct': profit, 'is_win': profit > 0 })
+        if fill_bar_tp[k]:
+            # 進場當根就觸及停利：看細 K 線中成交後先碰到哪一邊
+            ambiguous_bars += 1
+            result = _refine_intrabar(sub_bars_of(j), d, take_profit[t], stop_loss[t], entry=entry_level[t]) if refine_bars is not None else None
+            if result is not None:
+                refined += 1
+                exit_index, (exit_reason, exit_time) = j, result
+        if exit_tie[k] and exit_time is None:
+            # 出場那根同時觸及停利與停損 (進場當根已判斷出場時不會走到這根)
+            ambiguous_bars += 1
+            result = _refine_intrabar(sub_bars_of(exit_index), d, take_profit[t], stop_loss[t]) if refine_bars is not None else None
+            if result is not None:
+                refined += 1
+                exit_reason, exit_time = result
         
-        initial_capital *= (1 + profit)
-        initial_capital -= initial_capital * commission_rate
-        if capital: capital[-1] = initial_capital 
-
-    # --- 計算回測結果 ---
-    total_return = ((initial_capital - 100000) / 100000) * 100
-    total_trades = len(trades)
-    win_rate = (sum(1 for t in trades if t['is_win']) / total_trades) * 100 if total_trades > 0 else 0
+        entry_price = min(entry_level[t], open_[j]) if d == 1 else max(entry_level[t], open_[j]) # 跳空開在進場價之外時以開盤價成交
+        if exit_reason == "TP": exit_price = take_profit[t] if exit_index == j else (max(take_profit[t], open_[exit_index]) if d == 1 else min(take_profit[t], open_[exit_index]))
+        elif exit_reason == "SL": exit_price = min(stop_loss[t], open_[exit_index]) if d == 1 else max(stop_loss[t], open_[exit_index]) # 含進場當根：跳空開在停損之外即以開盤價停損
+        else: exit_price = close[exit_index]
+        
+        gross = d * (exit_price - entry_price) / entry_price
+        risk = abs(entry_price - stop_loss[t])
+        trades.append({
+            "signal_date": df.index[t], "direction": "多" if d == 1 else "空", "action": signals['Action'].iloc[t],
+            "entry_date": df.index[j], "entry_price": entry_price, "take_profit": take_profit[t], "stop_loss": stop_loss[t],
+            "exit_date": exit_time if exit_time is not None else df.index[exit_index], "exit_price": exit_price, "exit_reason": exit_reason,
+            "r_multiple": d * (exit_price - entry_price) / risk if risk > 0 else np.nan,
+            "return_pct": ((1 - commission_rate) * (1 + gross) * (1 - commission_rate) - 1) * 100,
+            "ambiguous_bars": ambiguous_bars,
+        })
+        k = int(np.searchsorted(candidates, exit_index, side='left'))
+        if k < len(candidates): k = int(next_fill[k])
     
-    capital_series = pd.Series(capital)
-    max_value = capital_series.expanding(min_periods=1).max()
-    drawdown = (capital_series - max_value) / max_value
-    max_drawdown = abs(drawdown.min()) * 100
+    if not trades: return {"trades": pd.DataFrame(), "total_trades": 0, "win_rate": 0, "total_return": 0, "max_drawdown": 0, "avg_r": 0, "ambiguous": 0, "refined": 0}
     
+    trades = pd.DataFrame(trades)
+    equity = np.cumprod(np.concatenate(([1.0], 1 + trades['return_pct'].to_numpy() / 100)))
+    peak = np.maximum.accumulate(equity)
     return {
-        "total_return": round(total_return, 2),
-        "win_rate": round(win_rate, 2),
-        "max_drawdown": round(max_drawdown, 2),
-        "total_trades": total_trades,
-        "message": f"回測區間 {data.index[0].strftime('%Y-%m-%d')} 到 {data.index[-1].strftime('%Y-%m-%d')}。",
-        "capital_curve": capital_series
+        "trades": trades,
+        "total_trades": len(trades),
+        "win_rate": round((trades['return_pct'] > 0).mean() * 100, 2),
+        "total_return": round((equity[-1] - 1) * 100, 2),
+        "max_drawdown": round(((peak - equity) / peak).max() * 100, 2),
+        "avg_r": round(trades['r_multiple'].mean(), 2),
+        "exit_reasons": trades['exit_reason'].value_counts().to_dict(),
+        "ambiguous": int(trades['ambiguous_bars'].sum()),
+        "refined": refined,
     }
 
 # calculate_fundamental_rating (確認已納入您的 ROE>15%, PE, FCF/Debt 原則)
@@ -421,10 +1789,7 @@ def calculate_fundamental_rating(symbol):
     融合了 '基本面的判斷標準'，特別是 ROE > 15%、PE 估值、以及現金流/負債健康度。
     """
     try:
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
-        
-        # 排除指數和加密貨幣
+        # 排除指數和加密貨幣 (不需要抓取 info)
         if symbol.startswith('^') or symbol.endswith('-USD'):
             return {
                 "Combined_Rating": 0.0, 
@@ -432,6 +1797,9 @@ def calculate_fundamental_rating(symbol):
                 "Details": None
             }
 
+        # 與 get_company_info 共用每日快照，Details 只保留精簡欄位
+        info = get_fundamentals_snapshot(symbol)["data"]
+
         roe = info.get('returnOnEquity', 0) 
         trailingPE = info.get('trailingPE', 99) 
         freeCashFlow = info.get('freeCashflow', 0) 
@@ -480,15 +1848,78 @@ def calculate_fundamental_rating(symbol):
     except Exception as e:
         return { "Combined_Rating": 1.0, "Message": f"基本面數據獲取失敗或不適用 (代碼可能錯誤或數據缺失)。", "Details": None }
 
+# ==============================================================================
+# 基本面全市場篩選 (向量化評分)
+# ==============================================================================
+
+# 與 calculate_fundamental_rating 相同的缺值預設
+FUNDAMENTAL_DEFAULTS = {'returnOnEquity': 0, 'trailingPE': 99, 'freeCashflow': 0, 'totalCash': 0, 'totalDebt': 0}
+FUNDAMENTAL_RATING_LABELS = ["頂級優異", "良好穩健", "中性警示", "基本面較弱"]
+
+def get_screener_universe():
+    """FULL_SYMBOLS_MAP 中所有具標準基本面的代碼 (排除指數與加密貨幣)。"""
+    return [symbol for symbol in FULL_SYMBOLS_MAP if not (symbol.startswith('^') or symbol.endswith('-USD'))]
+
+def fetch_fundamentals_table(symbols, max_workers=WARMUP_MAX_WORKERS, progress_callback=None):
+    """以有界執行緒池並行取得各代碼的每日基本面快照，組成 (代碼 × 欄位) 表；抓取失敗的代碼 fetched=False。"""
+    rows = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(get_fundamentals_snapshot, symbol): symbol for symbol in symbols}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                rows[futures[future]] = dict(future.result()["data"], fetched=True)
+            except Exception:
+                rows[futures[future]] = {"fetched": False}
+            if progress_callback: progress_callback(done, len(symbols))
+    
+    table = pd.DataFrame.from_dict(rows, orient='index').reindex(index=list(symbols), columns=list(FUNDAMENTAL_FIELDS) + ['fetched'])
+    table['fetched'] = table['fetched'].fillna(False).astype(bool)
+    return table
+
+def score_fundamentals_table(table):
+    """
+    以陣列運算對整張基本面表套用 calculate_fundamental_rating 的 ROE / PE / 現金流分級，
+    各級門檻與純量版本逐一對應 (np.select 依序匹配等同 if/elif)，抓取失敗者同樣給 1.0。
+    """
+    values = {field: pd.to_numeric(table[field], errors='coerce').fillna(default).to_numpy(dtype=float)
+              for field, default in FUNDAMENTAL_DEFAULTS.items()}
+    roe, pe = values['returnOnEquity'], values['trailingPE']
+    fcf, cash, debt = values['freeCashflow'], values['totalCash'], values['totalDebt']
+    
+    roe_score = np.select([roe > 0.15, roe > 0.10, roe > 0], [3, 2, 1], 0)
+    pe_score = np.select([(pe < 15) & (pe > 0), (pe < 25) & (pe > 0), (pe < 35) & (pe > 0)], [3, 2, 1], 0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cash_debt_ratio = np.where(debt != 0, cash / np.where(debt != 0, debt, 1), 100)
+    cf_score = np.select([(fcf > 0) & (cash_debt_ratio > 2), (fcf > 0) & (cash_debt_ratio > 1), fcf > 0], [3, 2, 1], 0)
+    
+    fetched = table['fetched'].to_numpy(dtype=bool)
+    combined = np.where(fetched, roe_score + pe_score + cf_score, 1.0)
+    label = np.where(fetched, np.select([combined >= 7, combined >= 5, combined >= 3], FUNDAMENTAL_RATING_LABELS[:3], FUNDAMENTAL_RATING_LABELS[3]), "數據獲取失敗")
+    
+    return table.assign(
+        ROE_Score=roe_score, PE_Score=pe_score, CF_Score=cf_score,
+        Combined_Rating=combined, Rating_Label=label,
+    )
+
+def screen_fundamentals(symbols=None, min_rating=0.0, max_workers=WARMUP_MAX_WORKERS, progress_callback=None):
+    """全市場基本面排行：取得快照表 → 向量化評分 → 依綜合評級篩選並由高到低排序。"""
+    symbols = get_screener_universe() if symbols is None else symbols
+    scored = score_fundamentals_table(fetch_fundamentals_table(symbols, max_workers, progress_callback))
+    scored = scored[scored['Combined_Rating'] >= min_rating]
+    return scored.sort_values(['Combined_Rating', 'returnOnEquity'], ascending=[False, False], kind='stable')
+
 # generate_expert_fusion_signal (確認已納入 ATR R:R 風險管理和多指標融合)
 # ⭐️ 優化 2: 修正策略建議中的價格顯示格式，使其對低價/加密貨幣更精確
-def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_symbol="$"):
+def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_symbol="$", weights=None):
     """
     融合了精確的技術分析標準 (MA 排列、RSI 50 中軸、MACD 動能、ADX 濾鏡) 
     並納入了 ATR 風險控制 (TP/SL) 和 R:R 2:1 的原則。
+    weights 為專家權重與行動門檻 (預設 DEFAULT_FUSION_WEIGHTS，校準後的權重見 get_fusion_weights)。
     """
+    w = weights or DEFAULT_FUSION_WEIGHTS
     
-    df_clean = df.dropna().copy()
+    df_clean = _as_frame(df).dropna()
     if df_clean.empty or len(df_clean) < 2:
         return {'action': '數據不足', 'score': 0, 'confidence': 0, 'strategy': '無法評估', 'entry_price': 0, 'take_profit': 0, 'stop_loss': 0, 'current_price': 0, 'expert_opinions': {}, 'atr': 0}
 
@@ -510,22 +1941,22 @@ def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_sym
     curr_10_above_50 = ema_10 > ema_50
     
     if not prev_10_above_50 and curr_10_above_50:
-        ma_score = 3.5 # 黃金交叉
+        ma_score = w['ma_cross'] # 黃金交叉
         expert_opinions['趨勢分析 (MA 交叉)'] = "**🚀 黃金交叉 (GC)**：EMA 10 向上穿越 EMA 50，強勁看漲信號！"
     elif prev_10_above_50 and not curr_10_above_50:
-        ma_score = -3.5 # 死亡交叉
+        ma_score = -w['ma_cross'] # 死亡交叉
         expert_opinions['趨勢分析 (MA 交叉)'] = "**💀 死亡交叉 (DC)**：EMA 10 向下穿越 EMA 50，強勁看跌信號！"
     elif ema_10 > ema_50 and ema_50 > ema_200:
-        ma_score = 2.0 # 強多頭排列 (10 > 50 > 200)
+        ma_score = w['ma_alignment'] # 強多頭排列 (10 > 50 > 200)
         expert_opinions['趨勢分析 (MA 排列)'] = "強勢多頭排列：**10 > 50 > 200**，趨勢結構穩固。"
     elif ema_10 < ema_50 and ema_50 < ema_200:
-        ma_score = -2.0 # 強空頭排列
+        ma_score = -w['ma_alignment'] # 強空頭排列
         expert_opinions['趨勢分析 (MA 排列)'] = "強勢空頭排列：**10 < 50 < 200**，趨勢結構崩潰。"
     elif curr_10_above_50:
-        ma_score = 1.0
+        ma_score = w['ma_side']
         expert_opinions['趨勢分析 (MA 排列)'] = "多頭：EMA 10 位於 EMA 50 之上。"
     else:
-        ma_score = -1.0
+        ma_score = -w['ma_side']
         expert_opinions['趨勢分析 (MA 排列)'] = "空頭：EMA 10 位於 EMA 50 之下。"
 
     # 2. 動能專家 (RSI 9)
@@ -533,16 +1964,16 @@ def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_sym
     rsi = last_row['RSI']
     
     if rsi > 60:
-        momentum_score = -2.0 
+        momentum_score = -w['rsi_extreme'] 
         expert_opinions['動能分析 (RSI 9)'] = "警告：RSI > 60，動能過熱，潛在回調壓力大。"
     elif rsi < 40:
-        momentum_score = 2.0 
+        momentum_score = w['rsi_extreme'] 
         expert_opinions['動能分析 (RSI 9)'] = "強化：RSI < 40，動能低位，潛在反彈空間大。"
     elif rsi > 50: 
-        momentum_score = 1.0 
+        momentum_score = w['rsi_side'] 
         expert_opinions['動能分析 (RSI 9)'] = "多頭：RSI > 50 中軸，維持在強勢區域。"
     else:
-        momentum_score = -1.0 
+        momentum_score = -w['rsi_side'] 
         expert_opinions['動能分析 (RSI 9)'] = "空頭：RSI < 50 中軸，維持在弱勢區域。"
 
     # 3. 趨勢強度專家 (MACD 8/17/9 & ADX 9)
@@ -552,10 +1983,10 @@ def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_sym
 
     # MACD 動能
     if macd_diff > 0 and macd_diff > prev_macd_diff:
-        strength_score += 1.5
+        strength_score += w['macd']
         expert_opinions['趨勢強度 (MACD)'] = "多頭：MACD 柱狀圖放大，多頭動能強勁。"
     elif macd_diff < 0 and macd_diff < prev_macd_diff:
-        strength_score -= 1.5
+        strength_score -= w['macd']
         expert_opinions['趨勢強度 (MACD)'] = "空頭：MACD 柱狀圖放大，空頭動能強勁。"
     else:
         strength_score += 0
@@ -563,7 +1994,7 @@ def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_sym
 
     # ADX 確認 (ADX > 25 確認強趨勢)
     if adx_value > 25:
-        strength_score *= 1.5 # 趨勢強度大於 25 時，強化信號
+        strength_score *= w['adx_multiplier'] # 趨勢強度大於 25 時，強化信號
         expert_opinions['趨勢強度 (ADX 9)'] = f"**確認強趨勢**：ADX {adx_value:.2f} > 25，信號有效性高。"
     else:
         expert_opinions['趨勢強度 (ADX 9)'] = f"盤整：ADX {adx_value:.2f} < 25，信號有效性降低。"
@@ -576,10 +2007,10 @@ def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_sym
     is_strong_down = not is_up_bar and (last_row['Open'] - last_row['Close']) > atr_value * 0.7
 
     if is_strong_up:
-        kline_score = 1.0
+        kline_score = w['kline']
         expert_opinions['K線形態分析'] = "強化：實體大陽線（> 0.7 ATR），買盤積極。"
     elif is_strong_down:
-        kline_score = -1.0
+        kline_score = -w['kline']
         expert_opinions['K線形態分析'] = "削弱：實體大陰線（> 0.7 ATR），賣壓沉重。"
     else:
         kline_score = 0
@@ -587,17 +2018,17 @@ def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_sym
 
     # 5. 融合評分 (納入 FA Score)
     fa_normalized_score = ((fa_rating / 9) * 6) - 3 if fa_rating > 0 else 0
-    fusion_score = ma_score + momentum_score + strength_score + kline_score + fa_normalized_score
+    fusion_score = ma_score + momentum_score + strength_score + kline_score + fa_normalized_score * w['fa']
     
     # 最終行動
     action = "觀望 (Neutral)"
-    if fusion_score >= 4.0: action = "買進 (Buy)"
-    elif fusion_score >= 1.0: action = "中性偏買 (Hold/Buy)"
-    elif fusion_score <= -4.0: action = "賣出 (Sell/Short)"
-    elif fusion_score <= -1.0: action = "中性偏賣 (Hold/Sell)"
+    if fusion_score >= w['strong_threshold']: action = "買進 (Buy)"
+    elif fusion_score >= w['lean_threshold']: action = "中性偏買 (Hold/Buy)"
+    elif fusion_score <= -w['strong_threshold']: action = "賣出 (Sell/Short)"
+    elif fusion_score <= -w['lean_threshold']: action = "中性偏賣 (Hold/Sell)"
         
     # 信心指數
-    MAX_SCORE = 13.75 
+    MAX_SCORE = w['max_score'] 
     confidence = min(100, max(0, 50 + (fusion_score / MAX_SCORE) * 50))
     
     # 風險控制與交易策略 (R:R 2:1 的原則)
@@ -638,38 +2069,517 @@ def generate_expert_fusion_signal(df, fa_rating, is_long_term=True, currency_sym
         'atr': atr_value
     }
 
-def create_comprehensive_chart(df, symbol, period_key):
-    df_clean = df.dropna().copy()
+FUSION_BUY_ACTIONS = ("買進 (Buy)", "中性偏買 (Hold/Buy)")
+FUSION_SELL_ACTIONS = ("賣出 (Sell/Short)", "中性偏賣 (Hold/Sell)")
+
+FUSION_FEATURES = ('ma_cross', 'ma_alignment', 'ma_side', 'rsi_extreme', 'rsi_side', 'macd', 'macd_adx', 'kline')
+
+def fusion_expert_features(df_clean):
+    """
+    各專家判斷的單位特徵 (每根 K 線取 -1 / 0 / 1，與 generate_expert_fusion_signal 的 if/elif 分支一一對應)：
+    同一位專家只會有一個分支成立，因此專家分數 = 特徵 × 對應權重，融合分數即為特徵矩陣與權重向量的乘積。
+    MACD 依 ADX 是否 > 25 拆成 macd / macd_adx 兩欄 (後者權重 = macd × adx_multiplier)。
+    """
+    close, open_ = df_clean['Close'].to_numpy(dtype=float), df_clean['Open'].to_numpy(dtype=float)
+    atr, adx = df_clean['ATR'].to_numpy(dtype=float), df_clean['ADX'].to_numpy(dtype=float)
+    ema_10, ema_50, ema_200 = (df_clean[column].to_numpy(dtype=float) for column in ('EMA_10', 'EMA_50', 'EMA_200'))
+    rsi, macd_diff = df_clean['RSI'].to_numpy(dtype=float), df_clean['MACD'].to_numpy(dtype=float)
+    
+    # 1. 均線交叉與排列專家 (依序：交叉 → 排列 → EMA 10 / 50 相對位置)
+    curr_10_above_50 = ema_10 > ema_50
+    prev_10_above_50 = _shift(ema_10, 1) > _shift(ema_50, 1)
+    ma_branch = np.select(
+        [~prev_10_above_50 & curr_10_above_50, prev_10_above_50 & ~curr_10_above_50,
+         (ema_10 > ema_50) & (ema_50 > ema_200), (ema_10 < ema_50) & (ema_50 < ema_200), curr_10_above_50],
+        [0, 1, 2, 3, 4], 5)
+    
+    # 2. 動能專家 (RSI 9)：< 40 / > 60 為反向的極端區，其餘看 50 中軸
+    rsi_extreme = np.select([rsi > 60, rsi < 40], [-1.0, 1.0], 0.0)
+    rsi_side = np.where(rsi_extreme != 0, 0.0, np.where(rsi > 50, 1.0, -1.0))
+    
+    # 3. 趨勢強度專家 (MACD 動能 × ADX 確認)
+    prev_macd_diff = _shift(macd_diff, 1)
+    macd = np.select([(macd_diff > 0) & (macd_diff > prev_macd_diff), (macd_diff < 0) & (macd_diff < prev_macd_diff)], [1.0, -1.0], 0.0)
+    
+    # 4. K線形態專家
+    is_up_bar = close > open_
+    kline = np.select([is_up_bar & ((close - open_) > atr * 0.7), ~is_up_bar & ((open_ - close) > atr * 0.7)], [1.0, -1.0], 0.0)
+    
+    return {
+        'ma_cross': np.select([ma_branch == 0, ma_branch == 1], [1.0, -1.0], 0.0),
+        'ma_alignment': np.select([ma_branch == 2, ma_branch == 3], [1.0, -1.0], 0.0),
+        'ma_side': np.select([ma_branch == 4, ma_branch == 5], [1.0, -1.0], 0.0),
+        'rsi_extreme': rsi_extreme,
+        'rsi_side': rsi_side,
+        'macd': np.where(adx > 25, 0.0, macd),
+        'macd_adx': np.where(adx > 25, macd, 0.0),
+        'kline': kline,
+    }
+
+def fusion_weight_vector(weights):
+    """權重字典 → 與 FUSION_FEATURES 對應的權重向量。"""
+    return np.array([weights['ma_cross'], weights['ma_alignment'], weights['ma_side'], weights['rsi_extreme'], weights['rsi_side'],
+                     weights['macd'], weights['macd'] * weights['adx_multiplier'], weights['kline']])
+
+def generate_fusion_signal_series(df, fa_rating, weights=None):
+    """
+    generate_expert_fusion_signal 的全歷史向量化版本：一次算出每根 K 線的四位專家分數、融合分數、
+    行動、信心指數與 ATR 進場/止盈/止損價位 (各級判斷以 np.select 依序匹配，等同原本的 if/elif)。
+    最後一列與 generate_expert_fusion_signal 的結果一致；第一列沒有前一根 K 線可比較，標記為數據不足。
+    Signal 欄：偏多行動 = 1、偏空行動 = -1、觀望 = 0，可直接用於回測。
+    """
+    w = weights or DEFAULT_FUSION_WEIGHTS
+    df_clean = _as_frame(df).dropna()
+    close, atr = df_clean['Close'].to_numpy(dtype=float), df_clean['ATR'].to_numpy(dtype=float)
+    features = fusion_expert_features(df_clean)
+    
+    # 1~4. 專家分數 = 單位特徵 × 權重
+    ma_score = features['ma_cross'] * w['ma_cross'] + features['ma_alignment'] * w['ma_alignment'] + features['ma_side'] * w['ma_side']
+    momentum_score = features['rsi_extreme'] * w['rsi_extreme'] + features['rsi_side'] * w['rsi_side']
+    strength_score = features['macd'] * w['macd'] + features['macd_adx'] * (w['macd'] * w['adx_multiplier'])
+    kline_score = features['kline'] * w['kline']
+    
+    # 5. 融合評分與行動
+    fa_normalized_score = ((fa_rating / 9) * 6) - 3 if fa_rating > 0 else 0
+    fusion_score = ma_score + momentum_score + strength_score + kline_score + fa_normalized_score * w['fa']
+    action = np.select(
+        [fusion_score >= w['strong_threshold'], fusion_score >= w['lean_threshold'], fusion_score <= -w['strong_threshold'], fusion_score <= -w['lean_threshold']],
+        [FUSION_BUY_ACTIONS[0], FUSION_BUY_ACTIONS[1], FUSION_SELL_ACTIONS[0], FUSION_SELL_ACTIONS[1]], "觀望 (Neutral)").astype(object)
+    confidence = np.minimum(100, np.maximum(0, 50 + (fusion_score / w['max_score']) * 50))
+    signal = np.select([fusion_score >= w['lean_threshold'], fusion_score <= -w['lean_threshold']], [1, -1], 0)
+    
+    # 6. ATR 風險控制 (與純量版本相同：2 ATR 風險單位、R:R 2:1、0.3 ATR 進場緩衝)
+    entry_buffer = atr * 0.3
+    entry = np.select([signal == 1, signal == -1], [close - entry_buffer, close + entry_buffer], close)
+    stop_loss = np.select([signal == 1, signal == -1], [entry - (atr * 2.0), entry + (atr * 2.0)], close - atr)
+    take_profit = np.select([signal == 1, signal == -1], [entry + (atr * 2.0 * 2.0), entry - (atr * 2.0 * 2.0)], close + atr)
+    
+    signals = pd.DataFrame({
+        'MA_Score': ma_score, 'Momentum_Score': momentum_score, 'Strength_Score': strength_score, 'KLine_Score': kline_score,
+        'Fusion_Score': fusion_score, 'Action': action, 'Confidence': confidence, 'Signal': signal,
+        'Entry_Price': entry, 'Take_Profit': take_profit, 'Stop_Loss': stop_loss,
+    }, index=df_clean.index)
+    
+    if len(signals):
+        signals.iloc[0, signals.columns.get_indexer(['MA_Score', 'Strength_Score', 'Fusion_Score', 'Confidence'])] = np.nan
+        signals.iloc[0, signals.columns.get_loc('Action')] = '數據不足'
+        signals.iloc[0, signals.columns.get_loc('Signal')] = 0
+    return signals
+
+# ==============================================================================
+# 融合權重校準 (依資產類別，時間序列交叉驗證)
+# ==============================================================================
+
+FUSION_CALIBRATION_MARKETS = ("US", "TW", "CRYPTO")
+
+@st.cache_resource
+def load_fusion_weights():
+    """啟動時載入一次校準後的融合權重：{資產類別: 權重}；沒有校準檔或某類別未採用校準結果時使用預設值。"""
+    if not os.path.exists(FUSION_WEIGHTS_PATH): return {}
+    try:
+        with open(FUSION_WEIGHTS_PATH, encoding="utf-8") as f:
+            calibration = json.load(f)
+    except Exception:
+        return {}
+    return {market: dict(DEFAULT_FUSION_WEIGHTS, **entry['weights']) for market, entry in calibration.items() if entry.get('adopted')}
+
+def get_fusion_weights(symbol):
+    return load_fusion_weights().get(get_market_of(symbol), DEFAULT_FUSION_WEIGHTS)
+
+def build_fusion_training_set(symbols, period="5y", interval="1d", horizon=5):
+    """
+    校準用的訓練資料：各標的的專家單位特徵矩陣 (樣本 × FUSION_FEATURES)、未來 horizon 根 K 線報酬與樣本時間 (UTC, ns)。
+    基本面只有當下的快照 (沒有歷史時點數據)，納入會產生前視偏差，因此校準只使用技術面特徵，fa 權重維持預設。
+    """
+    frames, _ = load_symbol_frames(symbols, period, interval)
+    features, forward_returns, times = [], [], []
+    for df in frames.values():
+        df_clean = calculate_technical_indicators(_as_frame(df)).dropna() if not df.empty else df
+        if len(df_clean) <= horizon + 1: continue
+        close = df_clean['Close'].to_numpy(dtype=float)
+        forward = np.full(len(close), np.nan)
+        forward[:-horizon] = close[horizon:] / close[:-horizon] - 1
+        valid = ~np.isnan(forward)
+        valid[0] = False # 第一根沒有前一根 K 線可判斷交叉
+        
+        feature_of = fusion_expert_features(df_clean)
+        features.append(np.column_stack([feature_of[name] for name in FUSION_FEATURES])[valid])
+        forward_returns.append(forward[valid])
+        times.append(df_clean.index.tz_convert("UTC").asi8[valid] if df_clean.index.tz is not None else df_clean.index.asi8[valid])
+    if not features: return np.empty((0, len(FUSION_FEATURES))), np.empty(0), np.empty(0, dtype=np.int64)
+    return np.vstack(features), np.concatenate(forward_returns), np.concatenate(times)
+
+def _sample_fusion_candidates(n_candidates, rng):
+    """候選權重：第 0 組為預設值，其餘在預設值附近以對數常態擾動，門檻則隨機抽樣 (強門檻 > 弱門檻)。"""
+    base = ('ma_cross', 'ma_alignment', 'ma_side', 'rsi_extreme', 'rsi_side', 'macd', 'adx_multiplier', 'kline')
+    candidates = [dict(DEFAULT_FUSION_WEIGHTS)]
+    for _ in range(n_candidates - 1):
+        weights = dict(DEFAULT_FUSION_WEIGHTS)
+        weights.update({name: float(DEFAULT_FUSION_WEIGHTS[name] * rng.lognormal(0, 0.5)) for name in base})
+        weights['lean_threshold'] = float(rng.uniform(0.5, 2.5))
+        weights['strong_threshold'] = float(weights['lean_threshold'] + rng.uniform(1.0, 5.0))
+        candidates.append(weights)
+    return candidates
+
+def _fusion_objective(scores, forward_returns, lean, strong, masks):
+    """
+    每組候選權重在各樣本子集上的目標函數：依融合分數建立部位 (偏多 0.5、買進 1、偏空 -0.5、賣出 -1)，
+    以部位 × 未來報酬的平均值 / 標準差 (類 Sharpe) 評分。masks 為 (子集 × 樣本) 的 0/1 矩陣，
+    各子集的一、二階和以矩陣乘積一次取得。回傳 (子集 × 候選)。
+    """
+    position = 0.5 * ((scores >= lean).astype(float) + (scores >= strong)) - 0.5 * ((scores <= -lean).astype(float) + (scores <= -strong))
+    pnl = position * forward_returns[:, None]
+    counts = np.maximum(masks.sum(axis=1, keepdims=True), 1)
+    mean = (masks @ pnl) / counts
+    std = np.sqrt(np.maximum((masks @ (pnl * pnl)) / counts - mean * mean, 0))
+    return np.divide(mean, std, out=np.zeros_like(mean), where=std > 1e-12)
+
+def _fusion_max_path(weights):
+    return weights['ma_cross'] + weights['rsi_extreme'] + weights['macd'] * weights['adx_multiplier'] + weights['kline']
+
+def calibrate_fusion_weights(market, symbols=None, period="5y", interval="1d", horizon=5, n_candidates=2000, n_splits=4, seed=0, chunk_size=250):
+    """
+    依資產類別校準融合權重與行動門檻。所有候選的融合分數以 (樣本 × 特徵) @ (特徵 × 候選) 的矩陣乘積一次算出，
+    不需重跑指標或信號流程。時間序列交叉驗證採擴張視窗：第 i 折以較早的樣本選出最佳候選、在緊接著的下一段評分，
+    訓練段與驗證段之間保留 horizon 根 K 線的間隔，避免未來報酬重疊。
+    只有當「選擇程序」的平均驗證分數優於預設權重時才採用 (adopted)，採用的是以全部樣本選出的最佳候選。
+    """
+    symbols = symbols if symbols is not None else [symbol for symbol in FULL_SYMBOLS_MAP if get_market_of(symbol) == market and not (market != "TW" and symbol.startswith('^'))]
+    features, forward_returns, times = build_fusion_training_set(symbols, period, interval, horizon)
+    if len(forward_returns) < 100 * (n_splits + 1):
+        return {"adopted": False, "weights": dict(DEFAULT_FUSION_WEIGHTS), "samples": int(len(forward_returns)), "message": "樣本不足"}
+    
+    candidates = _sample_fusion_candidates(n_candidates, np.random.default_rng(seed))
+    weight_matrix = np.column_stack([fusion_weight_vector(weights) for weights in candidates])
+    lean = np.array([weights['lean_threshold'] for weights in candidates])
+    strong = np.array([weights['strong_threshold'] for weights in candidates])
+    
+    # 擴張視窗的切點 (依時間分位數) 與訓練 / 驗證遮罩
+    boundaries = np.quantile(times, np.linspace(0, 1, n_splits + 2)[1:-1]).astype(np.int64)
+    embargo = int(horizon * INTERVAL_SECONDS.get(interval, 86400) * 2 * 1e9) # 含週末 / 假日的緩衝
+    masks = [np.ones(len(times), dtype=bool)] # 第 0 列：全部樣本；之後依序為各折的訓練段、驗證段
+    for i, boundary in enumerate(boundaries):
+        end = boundaries[i + 1] if i + 1 < len(boundaries) else np.iinfo(np.int64).max
+        masks += [times < boundary - embargo, (times >= boundary) & (times < end)]
+    masks = np.vstack(masks).astype(float)
+    
+    objective = np.zeros((len(masks), n_candidates))
+    for start in range(0, n_candidates, chunk_size):
+        block = slice(start, start + chunk_size)
+        objective[:, block] = _fusion_objective(features @ weight_matrix[:, block], forward_returns, lean[block], strong[block], masks)
+    full_scores, train_scores, validation_scores = objective[0], objective[1::2], objective[2::2]
+    
+    selected = train_scores.argmax(axis=1)
+    cv_score = float(validation_scores[np.arange(n_splits), selected].mean())
+    default_cv_score = float(validation_scores[:, 0].mean())
+    best = candidates[int(full_scores.argmax())]
+    
+    # 信心指數的滿分基準依「最強單向組合」(交叉 + RSI 極端 + MACD × ADX + K 線) 的比例縮放
+    best = dict(best, max_score=DEFAULT_FUSION_WEIGHTS['max_score'] * _fusion_max_path(best) / _fusion_max_path(DEFAULT_FUSION_WEIGHTS))
+    return {
+        "adopted": cv_score > default_cv_score,
+        "weights": {name: round(value, 4) for name, value in best.items()},
+        "cv_score": round(cv_score, 4),
+        "default_cv_score": round(default_cv_score, 4),
+        "samples": int(len(forward_returns)),
+        "symbols": len(symbols),
+        "horizon": horizon,
+        "fitted_at": datetime.now().isoformat(timespec='seconds'),
+    }
+
+def save_fusion_weights(calibration):
+    os.makedirs(os.path.dirname(FUSION_WEIGHTS_PATH), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(FUSION_WEIGHTS_PATH), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, FUSION_WEIGHTS_PATH)
+
+# ==============================================================================
+# 類別掃描器 (多行程並行計算融合信號)
+# ==============================================================================
+
+def _scan_row(symbol, df, fa_rating, is_long_term, currency_symbol, weights=None):
+    """單一標的 (已含指標欄位) 的融合信號，回傳排行表的一列。"""
+    row = {"代碼": symbol, "名稱": FULL_SYMBOLS_MAP.get(symbol, {}).get('name', symbol), "FA 評級": fa_rating}
+    if df.empty or len(df) < 200:
+        return dict(row, 行動="數據不足", 融合分數=np.nan, 信心指數=np.nan, 現價=np.nan, 進場價=np.nan, 止盈=np.nan, 止損=np.nan, **{"R:R": np.nan})
+    
+    analysis = generate_expert_fusion_signal(df, fa_rating=fa_rating, is_long_term=is_long_term, currency_symbol=currency_symbol, weights=weights)
+    risk = abs(analysis['entry_price'] - analysis['stop_loss'])
+    reward_risk = abs(analysis['take_profit'] - analysis['entry_price']) / risk if risk > 0 else np.nan
+    return dict(
+        row, 行動=analysis['action'], 融合分數=analysis['score'], 信心指數=analysis['confidence'], 現價=analysis['current_price'],
+        進場價=analysis['entry_price'], 止盈=analysis['take_profit'], 止損=analysis['stop_loss'], **{"R:R": round(reward_risk, 2)}
+    )
+
+def _scan_symbol(symbol, df, fa_rating, is_long_term, currency_symbol, weights=None):
+    """單一標的的完整分析：技術指標 → 融合信號 (多週期共振逐週期使用)。"""
+    if not df.empty and len(df) >= 200: df = calculate_technical_indicators(df)
+    return _scan_row(symbol, df, fa_rating, is_long_term, currency_symbol, weights)
+
+def rank_scan_results(rows):
+    """依融合分數、信心指數由高到低排序 (數據不足者排在最後)。"""
+    if not rows: return pd.DataFrame()
+    return pd.DataFrame(rows).sort_values(['融合分數', '信心指數'], ascending=[False, False], na_position='last', kind='stable').reset_index(drop=True)
+
+def scan_category(category_key, period, interval, is_long_term=True, progress_callback=None):
+    """
+    掃描整個 CATEGORY_MAP 類別：先以執行緒池並行同步 K 線分區與基本面快照 (I/O)，
+    再以 load_category_indicators 一次批次計算整個類別的指標 (時間 × 標的矩陣)，最後把各檔的融合信號分派到行程池並行計算。
+    同步階段每完成一檔以 progress_callback(完成數, 總數, None) 回報，計算階段每完成一檔就以目前的排行表回報。
+    """
+    symbols = CATEGORY_MAP.get(category_key, [])
+    fetch_progress = (lambda done, total: progress_callback(done, total, None)) if progress_callback else None
+    with ThreadPoolExecutor(max_workers=WARMUP_MAX_WORKERS) as pool:
+        fa_futures = {symbol: pool.submit(calculate_fundamental_rating, symbol) for symbol in symbols} # 基本面快照與 K 線分區同時同步
+        indicator_frames = load_category_indicators(category_key, period, interval, progress_callback=fetch_progress)
+    
+    rows, futures = [], {}
+    compute_pool = get_compute_pool()
+    for symbol in symbols:
+        try:
+            fa_rating = fa_futures[symbol].result()['Combined_Rating']
+            df = indicator_frames.get(symbol, pd.DataFrame())
+            futures[compute_pool.submit(run_app_function, os.path.abspath(__file__), "_scan_row", symbol, df, fa_rating,
+                                        is_long_term, get_currency_symbol(symbol), get_fusion_weights(symbol))] = symbol
+        except Exception:
+            rows.append({"代碼": symbol, "名稱": FULL_SYMBOLS_MAP.get(symbol, {}).get('name', symbol), "行動": "分析失敗"})
+    
+    for future in as_completed(futures):
+        try:
+            rows.append(future.result())
+        except Exception:
+            symbol = futures[future]
+            rows.append({"代碼": symbol, "名稱": FULL_SYMBOLS_MAP.get(symbol, {}).get('name', symbol), "行動": "分析失敗"})
+        if progress_callback: progress_callback(len(rows), len(symbols), rank_scan_results(rows))
+    
+    return rank_scan_results(rows)
+
+def _direction_of(action):
+    if action in FUSION_BUY_ACTIONS: return 1
+    if action in FUSION_SELL_ACTIONS: return -1
+    return 0
+
+def analyze_timeframes(symbol, max_workers=len(PERIOD_MAP)):
+    """
+    多週期共振分析：同時分析 PERIOD_MAP 的所有週期。各來源週期的分區同步在執行緒池中並行進行 (1 日與 1 週共用日線分區，
+    經請求合併層只同步一次)，每個分區一完成就提交該週期的指標與融合信號計算，總耗時約等於最慢的單一週期。
+    回傳 (共振矩陣, 彙總)：矩陣每列為一個週期，彙總的 alignment 介於 -100 (全數偏空) 到 100 (全數偏多)。
+    """
+    fa_rating = calculate_fundamental_rating(symbol)['Combined_Rating']
+    currency_symbol = get_currency_symbol(symbol)
+    flight = get_single_flight("ohlcv")
+    
+    rows = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        refresh_futures = {}
+        for period_key, (period, interval) in PERIOD_MAP.items():
+            source_interval = RESAMPLED_INTERVALS.get(interval, interval)
+            refresh_futures[pool.submit(flight.do, (symbol, source_interval), refresh_stored_bars, symbol, source_interval)] = period_key
+        
+        compute_futures = {}
+        for future in as_completed(refresh_futures):
+            period_key = refresh_futures[future]
+            period, interval = PERIOD_MAP[period_key]
+            try:
+                # 直接由剛同步的分區切出此週期 (get_stock_data 的 TTL 快取可能仍是同步前的 K 線)
+                df = _bars_for_period(future.result()[0], symbol, period, interval)
+            except Exception:
+                df = pd.DataFrame()
+            compute_futures[pool.submit(_scan_symbol, symbol, df, fa_rating, True, currency_symbol, get_fusion_weights(symbol))] = period_key
+        
+        for future in as_completed(compute_futures):
+            try:
+                rows[compute_futures[future]] = future.result()
+            except Exception:
+                rows[compute_futures[future]] = {"行動": "分析失敗"}
+    
+    matrix = pd.DataFrame([dict(rows[period_key], 週期=period_key) for period_key in PERIOD_MAP]).set_index('週期')
+    matrix['方向'] = [_direction_of(action) for action in matrix['行動']]
+    matrix = matrix.reindex(columns=['行動', '方向', '融合分數', '信心指數', 'R:R', '現價', '進場價', '止盈', '止損'])
+    
+    directions = matrix['方向'].to_numpy()
+    alignment = float(directions.mean() * 100) if len(directions) else 0.0
+    if alignment >= 75: verdict = "多週期共振偏多"
+    elif alignment <= -75: verdict = "多週期共振偏空"
+    elif alignment > 0: verdict = "多週期略偏多 (方向分歧)"
+    elif alignment < 0: verdict = "多週期略偏空 (方向分歧)"
+    else: verdict = "多週期方向分歧"
+    
+    return matrix, {"alignment": round(alignment, 1), "verdict": verdict, "mean_score": round(float(matrix['融合分數'].mean()), 2)}
+
+# ==============================================================================
+# 圖表快取 (序列化 JSON + LRU)
+# ==============================================================================
+
+class FigureCache:
+    """
+    以記憶體位元組數為上限的 LRU 圖表快取：存放序列化後的 Plotly JSON (不可變字串，跨 session 共用也不會被修改)，命中時跳過指標軌跡的組裝。
+    同一 key 的並行建圖經由請求合併只做一次；hits / misses 記錄命中情況。
+    命中時仍需還原一個 Figure：st.plotly_chart 收到 dict 會以完整驗證重建 Figure，收到 Figure 則只做 to_dict() 與 JSON 序列化，
+    因此這裡以 _validate=False 還原 (JSON 本身由已驗證的 Figure 產生)，省下重新驗證；送到瀏覽器前的那一次序列化由 Streamlit 執行，無法略過。
+    """
+
+    def __init__(self, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flight = SingleFlight()
+
+    def get(self, key):
+        with self._lock:
+            spec = self._entries.get(key)
+            if spec is None: return None
+            self._entries.move_to_end(key)
+            return spec
+
+    def put(self, key, spec):
+        size = sys.getsizeof(spec)
+        if size > self.max_bytes: return # 單張圖超過整個上限時不快取
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None: self.bytes -= sys.getsizeof(old)
+            self._entries[key] = spec
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= sys.getsizeof(evicted)
+
+    def _build(self, key, build):
+        spec = build().to_json()
+        self.put(key, spec)
+        return spec
+
+    def figure(self, key, build):
+        """回傳 key 對應的 Figure；未命中時呼叫 build() 建圖並存入快取。"""
+        spec = self.get(key)
+        if spec is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            spec = self._flight.do(key, self._build, key, build)
+        return go.Figure(json.loads(spec), _validate=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+@st.cache_resource
+def get_figure_cache():
+    """跨 session 共用的圖表快取 (熱門標的的重複瀏覽直接命中)。"""
+    return FigureCache()
+
+def frame_fingerprint(df):
+    """數據指紋：(K 線數, 最後一根時間, 最後收盤價)；盤中最後一根 K 線更新收盤價時指紋也會改變。"""
+    if df is None or df.empty: return (0, None, None)
+    return (len(df), df.index[-1].isoformat(), float(df['Close'].iloc[-1]))
+
+def aggregate_ohlc_buckets(df, max_points=CHART_MAX_POINTS):
+    """
+    K 線的 OHLC 分桶聚合：每 ceil(n / max_points) 根合併為一根 (開 = 首根開盤、高 = 最高、低 = 最低、收 = 末根收盤)，
+    時間取每桶第一根，保留每段的真實高低點。回傳 (聚合後的 DataFrame, 每桶 K 線數)。
+    """
+    bucket = math.ceil(len(df) / max_points) if max_points else 1
+    if bucket <= 1: return df, 1
+    starts = np.arange(0, len(df), bucket)
+    ends = np.minimum(starts + bucket, len(df)) - 1
+    high, low = df['High'].to_numpy(dtype=float), df['Low'].to_numpy(dtype=float)
+    return pd.DataFrame({
+        'Open': df['Open'].to_numpy()[starts], 'High': np.maximum.reduceat(high, starts), 'Low': np.minimum.reduceat(low, starts), 'Close': df['Close'].to_numpy()[ends],
+    }, index=df.index[starts]), bucket
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降採樣：保留首尾兩點，其餘每個桶選出與「前一個選點」及「下一桶平均點」構成最大三角形的點，
+    在減少點數的同時保留線條的視覺形狀 (峰谷)。回傳被選中的位置 (遞增)。
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3: return np.arange(n)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    next_edges = np.append(edges[2:], n)
+    
+    # 下一桶的平均點可事先一次算好 (前綴和)
+    cum_x, cum_y = np.concatenate(([0.0], np.cumsum(x))), np.concatenate(([0.0], np.cumsum(y)))
+    next_count = next_edges - edges[1:]
+    avg_x = (cum_x[next_edges] - cum_x[edges[1:]]) / next_count
+    avg_y = (cum_y[next_edges] - cum_y[edges[1:]]) / next_count
+    
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - avg_x[i]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y[i] - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+def _line_points(df_clean, column, max_points):
+    """折線軌跡的 x / y：超過點數上限時以 LTTB 降採樣。"""
+    if len(df_clean) <= max_points: return dict(x=df_clean.index, y=df_clean[column])
+    picks = lttb_indices(df_clean.index.asi8, df_clean[column].to_numpy(dtype=float), max_points)
+    return dict(x=df_clean.index[picks], y=df_clean[column].iloc[picks])
+
+def create_comprehensive_chart(df, symbol, period_key, signals=None, max_points=CHART_MAX_POINTS, date_range=None):
+    """
+    完整技術分析圖表。數據量超過 max_points 時進入降採樣模式：K 線做 OHLC 分桶聚合、折線 (EMA / MACD / RSI / ADX) 以 LTTB 取點、
+    MACD 柱狀圖每桶保留絕對值最大的一根，折線改用 WebGL (Scattergl) 繪製。
+    date_range = (起, 迄) 時只繪製該區間，區間內的 K 線數不超過上限即恢復完整解析度。
+    """
+    df_clean = _as_frame(df).dropna()
+    if date_range is not None:
+        df_clean = df_clean[(df_clean.index >= date_range[0]) & (df_clean.index <= date_range[1])]
     if df_clean.empty: return go.Figure().update_layout(title="數據不足，無法繪製圖表")
+    
+    candles, bucket = aggregate_ohlc_buckets(df_clean, max_points)
+    Line = go.Scattergl if bucket > 1 else go.Scatter
+    title_note = f" · 已降採樣 (每點約 {bucket} 根 K 線，縮小顯示區間可看完整解析度)" if bucket > 1 else ""
 
     fig = make_subplots(rows=3, cols=1, 
                         shared_xaxes=True, 
                         vertical_spacing=0.08,
                         row_heights=[0.6, 0.2, 0.2],
-                        subplot_titles=(f"{symbol} 價格走勢 (週期: {period_key})", "MACD 指標", "RSI/ADX 指標"))
+                        subplot_titles=(f"{symbol} 價格走勢 (週期: {period_key}){title_note}", "MACD 指標", "RSI/ADX 指標"))
 
     # 1. 主圖：K線與均線 (EMA 10, 50, 200)
-    fig.add_trace(go.Candlestick(x=df_clean.index, open=df_clean['Open'], high=df_clean['High'], low=df_clean['Low'], close=df_clean['Close'], name='K線', increasing_line_color='#cc0000', decreasing_line_color='#1e8449'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df_clean.index, y=df_clean['EMA_10'], line=dict(color='#ffab40', width=1), name='EMA 10'), row=1, col=1) 
-    fig.add_trace(go.Scatter(x=df_clean.index, y=df_clean['EMA_50'], line=dict(color='#0077b6', width=1.5), name='EMA 50'), row=1, col=1) 
-    fig.add_trace(go.Scatter(x=df_clean.index, y=df_clean['EMA_200'], line=dict(color='#800080', width=1.5, dash='dash'), name='EMA 200'), row=1, col=1) 
+    fig.add_trace(go.Candlestick(x=candles.index, open=candles['Open'], high=candles['High'], low=candles['Low'], close=candles['Close'], name='K線', increasing_line_color='#cc0000', decreasing_line_color='#1e8449'), row=1, col=1)
+    fig.add_trace(Line(**_line_points(df_clean, 'EMA_10', max_points), line=dict(color='#ffab40', width=1), name='EMA 10'), row=1, col=1) 
+    fig.add_trace(Line(**_line_points(df_clean, 'EMA_50', max_points), line=dict(color='#0077b6', width=1.5), name='EMA 50'), row=1, col=1) 
+    fig.add_trace(Line(**_line_points(df_clean, 'EMA_200', max_points), line=dict(color='#800080', width=1.5, dash='dash'), name='EMA 200'), row=1, col=1) 
+    
+    # 歷史融合信號：只在行動轉為「買進」/「賣出」的那根 K 線標記，避免連續信號擠滿圖面
+    if signals is not None:
+        action = signals['Action'].reindex(df_clean.index)
+        buy_marks = (action == FUSION_BUY_ACTIONS[0]) & (action.shift() != FUSION_BUY_ACTIONS[0])
+        sell_marks = (action == FUSION_SELL_ACTIONS[0]) & (action.shift() != FUSION_SELL_ACTIONS[0])
+        fig.add_trace(go.Scatter(x=df_clean.index[buy_marks], y=df_clean['Low'][buy_marks] * 0.99, mode='markers', marker=dict(symbol='triangle-up', size=10, color='#cc0000'), name='融合信號：買進'), row=1, col=1)
+        fig.add_trace(go.Scatter(x=df_clean.index[sell_marks], y=df_clean['High'][sell_marks] * 1.01, mode='markers', marker=dict(symbol='triangle-down', size=10, color='#1e8449'), name='融合信號：賣出'), row=1, col=1)
     
     # 2. MACD 圖 (MACD Line 和 Signal Line)
-    colors = np.where(df_clean['MACD'] > 0, '#cc0000', '#1e8449') 
-    fig.add_trace(go.Bar(x=df_clean.index, y=df_clean['MACD'], name='MACD 柱狀圖', marker_color=colors, opacity=0.5), row=2, col=1)
-    fig.add_trace(go.Scatter(x=df_clean.index, y=df_clean['MACD_Line'], line=dict(color='#0077b6', width=1), name='DIF'), row=2, col=1)
-    fig.add_trace(go.Scatter(x=df_clean.index, y=df_clean['MACD_Signal'], line=dict(color='#ffab40', width=1), name='DEA'), row=2, col=1)
+    macd_bars = df_clean['MACD']
+    if bucket > 1: # 每桶保留絕對值最大的一根柱子
+        starts = np.arange(0, len(macd_bars), bucket)
+        values = macd_bars.to_numpy(dtype=float)
+        picks = starts + np.array([np.abs(values[i:i + bucket]).argmax() for i in starts])
+        macd_bars = macd_bars.iloc[picks]
+    colors = np.where(macd_bars > 0, '#cc0000', '#1e8449') 
+    fig.add_trace(go.Bar(x=macd_bars.index, y=macd_bars, name='MACD 柱狀圖', marker_color=colors, opacity=0.5), row=2, col=1)
+    fig.add_trace(Line(**_line_points(df_clean, 'MACD_Line', max_points), line=dict(color='#0077b6', width=1), name='DIF'), row=2, col=1)
+    fig.add_trace(Line(**_line_points(df_clean, 'MACD_Signal', max_points), line=dict(color='#ffab40', width=1), name='DEA'), row=2, col=1)
     fig.update_yaxes(title_text="MACD", row=2, col=1)
 
     # 3. RSI 圖 (包含 ADX)
-    fig.add_trace(go.Scatter(x=df_clean.index, y=df_clean['RSI'], line=dict(color='purple', width=1.5), name='RSI'), row=3, col=1)
+    fig.add_trace(Line(**_line_points(df_clean, 'RSI', max_points), line=dict(color='purple', width=1.5), name='RSI'), row=3, col=1)
     fig.add_hline(y=70, line_dash="dash", line_color="red", row=3, col=1, annotation_text="超買 (70)", annotation_position="top right")
     fig.add_hline(y=50, line_dash="dash", line_color="grey", row=3, col=1, annotation_text="多/空分界 (50)", annotation_position="top left")
     fig.add_hline(y=30, line_dash="dash", line_color="green", row=3, col=1, annotation_text="超賣 (30)", annotation_position="bottom right")
     fig.update_yaxes(title_text="RSI", range=[0, 100], row=3, col=1)
     
     # ADX - 使用第二個 Y 軸 (右側)
-    fig.add_trace(go.Scatter(x=df_clean.index, y=df_clean['ADX'], line=dict(color='#cc6600', width=1.5, dash='dot'), name='ADX', yaxis='y4'), row=3, col=1)
+    fig.add_trace(Line(**_line_points(df_clean, 'ADX', max_points), line=dict(color='#cc6600', width=1.5, dash='dot'), name='ADX', yaxis='y4'), row=3, col=1)
     fig.update_layout(yaxis4=dict(title="ADX", overlaying='y3', side='right', range=[0, 100], showgrid=False))
     fig.add_hline(y=25, line_dash="dot", line_color="#cc6600", row=3, col=1, annotation_text="強勢趨勢 (ADX 25)", annotation_position="bottom left", yref='y4')
 
@@ -683,6 +2593,20 @@ def create_comprehensive_chart(df, symbol, period_key):
 
     return fig
 
+def create_equity_chart(index, capital_curve, initial_capital=100000):
+    fig_bt = go.Figure()
+    fig_bt.add_trace(go.Scatter(x=index.to_list(), y=capital_curve, name='策略資金曲線', line=dict(color='#cc6600', width=2)))
+    fig_bt.add_hline(y=initial_capital, line_dash="dash", line_color="#1e8449", annotation_text=f"起始資金 ${initial_capital:,}", annotation_position="bottom right")
+    
+    fig_bt.update_layout(
+        title='SMA 20/EMA 50 交叉策略資金曲線',
+        xaxis_title='交易週期',
+        yaxis_title='賬戶價值 ($)',
+        margin=dict(l=20, r=20, t=40, b=20),
+        height=300
+    )
+    return fig_bt
+
 def update_search_input():
     if st.session_state.symbol_select_box and st.session_state.symbol_select_box != "請選擇標的...":
         code = st.session_state.symbol_select_box.split(' - ')[0]
@@ -691,9 +2615,12 @@ def update_search_input():
             st.session_state.last_search_symbol = code
             st.session_state.analyze_trigger = True
 
+def apply_symbol_suggestion(code):
+    st.session_state.sidebar_search_input = code
+
 
 # ==============================================================================
-# 3. Streamlit 主邏輯 (Main Function)
+# 4. Streamlit 主邏輯 (Main Function)
 # ==============================================================================
 
 def main():
@@ -777,6 +2704,14 @@ def main():
         label_visibility="collapsed"
     )
 
+    # 輸入內容不是已知代碼 / 名稱時，列出前綴與模糊比對的候選，點擊即填入
+    if selected_query.strip() and not get_symbol_index().resolve(selected_query):
+        suggestions = get_symbol_index().suggest(selected_query)
+        if suggestions:
+            st.sidebar.caption("您是不是要找：")
+            for code in suggestions:
+                st.sidebar.button(f"{code} - {FULL_SYMBOLS_MAP[code]['name']}", key=f"symbol_suggestion_{code}", on_click=apply_symbol_suggestion, args=(code,), use_container_width=True)
+
     final_symbol_to_analyze = get_symbol_from_query(selected_query)
 
     is_symbol_changed = final_symbol_to_analyze != st.session_state.get('last_search_symbol', "INIT")
@@ -802,6 +2737,38 @@ def main():
 
     is_long_term = selected_period_key in ["30 分","30 分","4 小時","1 日", "1 週"]
 
+    if st.sidebar.button("⚡ 預熱整個類別數據", key="warmup_category_button", help="並行下載目前類別所有標的在此週期的數據並寫入快取"):
+        warmup_progress = st.sidebar.progress(0.0, text="正在預熱類別數據...")
+        warmup_stats = warm_category_cache(
+            selected_category_key, yf_period, yf_interval,
+            progress_callback=lambda done, total: warmup_progress.progress(done / total, text=f"正在預熱類別數據... ({done}/{total})")
+        )
+        warmup_progress.empty()
+        st.sidebar.success(f"✅ 已預熱 {warmup_stats['loaded']}/{warmup_stats['symbols']} 個標的 ({selected_period_key})")
+
+    if st.sidebar.button("🧮 基本面全市場篩選", key="fundamental_screener_button", help="對所有美股/台股套用基本面評級規則並排序"):
+        screener_progress = st.sidebar.progress(0.0, text="正在取得基本面快照...")
+        st.session_state['screener_table'] = screen_fundamentals(
+            progress_callback=lambda done, total: screener_progress.progress(done / total, text=f"正在取得基本面快照... {done}/{total}")
+        )
+        screener_progress.empty()
+
+    if st.sidebar.button("🔎 掃描整個類別信號", key="scan_category_button", help="並行分析目前類別所有標的在此週期的融合信號並排序"):
+        scan_progress = st.sidebar.progress(0.0, text="正在掃描類別信號...")
+        scan_placeholder = st.empty()
+        
+        def show_scan_progress(done, total, ranked):
+            if ranked is None:
+                scan_progress.progress(done / total, text=f"正在同步 K 線數據... ({done}/{total})")
+                return
+            scan_progress.progress(done / total, text=f"正在掃描類別信號... ({done}/{total})")
+            scan_placeholder.dataframe(ranked, use_container_width=True, hide_index=True)
+        
+        st.session_state['scan_table'] = scan_category(selected_category_key, yf_period, yf_interval, is_long_term=is_long_term, progress_callback=show_scan_progress)
+        st.session_state['scan_label'] = f"{selected_category_key} / {selected_period_key}"
+        scan_progress.empty()
+        scan_placeholder.empty()
+
     st.sidebar.markdown("---")
 
     # --- 4. 開始分析 (Button) ---
@@ -809,6 +2776,17 @@ def main():
     
     analyze_button_clicked = st.sidebar.button("📊 執行AI分析", key="main_analyze_button") 
 
+    if st.sidebar.button("🧭 多週期共振分析", key="confluence_button", help="同時分析 30 分 / 4 小時 / 1 日 / 1 週 的融合信號"):
+        with st.spinner(f"🧭 正在同時分析 **{final_symbol_to_analyze}** 的所有週期..."):
+            st.session_state['confluence'] = (final_symbol_to_analyze,) + analyze_timeframes(final_symbol_to_analyze)
+
+    if PREFETCH_ENABLED:
+        prefetch_stats = start_prefetch_scheduler().stats
+        st.sidebar.caption(f"🛰️ 背景預抓：已更新 {prefetch_stats['refreshed']} / 無新 K 線 {prefetch_stats['unchanged']} (第 {prefetch_stats['runs']} 輪)")
+
+    ohlcv_flight, fundamentals_flight = get_single_flight("ohlcv"), get_single_flight("fundamentals")
+    st.sidebar.caption(f"🔗 已合併重複請求：K 線 {ohlcv_flight.coalesced} 次 / 基本面 {fundamentals_flight.coalesced} 次 (實際上游請求 {ohlcv_flight.executed + fundamentals_flight.executed} 次)")
+
     # === 主要分析邏輯 (Main Analysis Logic) ===
     if analyze_button_clicked or st.session_state.get('analyze_trigger', False):
         
@@ -837,11 +2815,13 @@ def main():
                         df, 
                         fa_rating=fa_result['Combined_Rating'], 
                         is_long_term=is_long_term,
-                        currency_symbol=currency_symbol 
+                        currency_symbol=currency_symbol,
+                        weights=get_fusion_weights(final_symbol_to_analyze)
                     )
                     
                     st.session_state['analysis_results'] = {
-                        'df': df,
+                        # 結果區塊只使用去除 NaN 後的數據，以精簡的 float32 連續緩衝保存，降低每位使用者的記憶體
+                        'df': CompactOHLCV.from_frame(df.dropna()),
                         'company_info': company_info,
                         'currency_symbol': currency_symbol,
                         'fa_result': fa_result,
@@ -857,11 +2837,78 @@ def main():
             st.info("💡 請檢查代碼格式或嘗試其他分析週期。")
             st.session_state['data_ready'] = False 
 
+    # === 多週期共振結果 ===
+    if st.session_state.get('confluence') is not None:
+        confluence_symbol, confluence_matrix, confluence_summary = st.session_state['confluence']
+        with st.expander(f"🧭 多週期共振矩陣：{confluence_symbol}", expanded=True):
+            col_alignment, col_score = st.columns(2)
+            col_alignment.metric("共振度 (Alignment)", f"{confluence_summary['alignment']:+.0f}", confluence_summary['verdict'])
+            col_score.metric("平均融合分數", f"{confluence_summary['mean_score']}")
+            st.dataframe(confluence_matrix, use_container_width=True)
+
+    # === 類別掃描結果 ===
+    if st.session_state.get('scan_table') is not None:
+        with st.expander(f"🔎 類別信號掃描：{st.session_state.get('scan_label', '')}", expanded=not st.session_state.get('data_ready', False)):
+            scan_table = st.session_state['scan_table']
+            scan_actions = st.multiselect("行動", sorted(scan_table['行動'].dropna().unique()) if not scan_table.empty else [], key="scan_actions")
+            st.dataframe(scan_table[scan_table['行動'].isin(scan_actions)] if scan_actions else scan_table, use_container_width=True, hide_index=True)
+
+    # === 投資組合回測 ===
+    with st.expander("📦 投資組合回測 (多標的 SMA 20/EMA 50 交叉，跨市場行事曆對齊)"):
+        portfolio_options = [symbol for symbol in FULL_SYMBOLS_MAP if not symbol.startswith('^')]
+        portfolio_symbols = st.multiselect(
+            "投資組合標的", portfolio_options,
+            default=[symbol for symbol in CATEGORY_MAP.get(selected_category_key, []) if symbol in portfolio_options][:10],
+            format_func=lambda symbol: f"{symbol} - {FULL_SYMBOLS_MAP[symbol]['name']}", key="portfolio_symbols"
+        )
+        col_weighting, col_rebalance = st.columns(2)
+        portfolio_weighting = col_weighting.radio("權重", ["equal", "volatility"], format_func={"equal": "等權重", "volatility": "反波動率"}.get, horizontal=True, key="portfolio_weighting")
+        portfolio_rebalance = col_rebalance.selectbox("再平衡頻率", list(PORTFOLIO_REBALANCE_RULES), index=2, key="portfolio_rebalance")
+        
+        if st.button("執行投資組合回測", key="portfolio_button") and portfolio_symbols:
+            with st.spinner(f"正在載入 {len(portfolio_symbols)} 個標的並計算投資組合 ({selected_period_key})..."):
+                portfolio_frames, _ = load_symbol_frames(portfolio_symbols, yf_period, yf_interval)
+                st.session_state['portfolio'] = run_portfolio_backtest(portfolio_frames, weighting=portfolio_weighting, rebalance=portfolio_rebalance)
+        
+        portfolio = st.session_state.get('portfolio')
+        if portfolio is not None:
+            col_pf_1, col_pf_2, col_pf_3, col_pf_4 = st.columns(4)
+            col_pf_1.metric("📊 總回報率", f"{portfolio['total_return']}%")
+            col_pf_2.metric("📉 最大回撤 (MDD)", f"{portfolio['max_drawdown']}%")
+            col_pf_3.metric("🔁 年化換手率", f"{portfolio['annual_turnover']}%")
+            col_pf_4.metric("⚖️ 再平衡次數", f"{portfolio['rebalances']} 次")
+            
+            fig_pf = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.7, 0.3], vertical_spacing=0.05)
+            fig_pf.add_trace(go.Scatter(x=portfolio['equity'].index, y=portfolio['equity'], name='投資組合淨值', line=dict(color='#cc6600', width=2)), row=1, col=1)
+            fig_pf.add_trace(go.Scatter(x=portfolio['drawdown'].index, y=portfolio['drawdown'], name='回撤 (%)', fill='tozeroy', line=dict(color='#1e8449', width=1)), row=2, col=1)
+            fig_pf.update_layout(margin=dict(l=20, r=20, t=20, b=20), height=400)
+            st.plotly_chart(fig_pf, use_container_width=True)
+            st.caption("ℹ️ 最新子帳戶權重 (持倉為 0 的子帳戶以現金保留)：")
+            st.dataframe(portfolio['weights'].iloc[-1].rename("權重").sort_values(ascending=False).to_frame().T, use_container_width=True, hide_index=True)
+
+    # === 基本面篩選結果 ===
+    if st.session_state.get('screener_table') is not None:
+        with st.expander("🧮 基本面全市場篩選 (ROE / PE / 現金流評級)", expanded=not st.session_state.get('data_ready', False)):
+            screener_table = st.session_state['screener_table']
+            min_rating = st.slider("最低綜合評級", 0, 9, 5, key="screener_min_rating")
+            selected_labels = st.multiselect("評級分類", FUNDAMENTAL_RATING_LABELS + ["數據獲取失敗"], default=FUNDAMENTAL_RATING_LABELS, key="screener_labels")
+            
+            screener_view = screener_table[(screener_table['Combined_Rating'] >= min_rating) & screener_table['Rating_Label'].isin(selected_labels)]
+            screener_view = screener_view.assign(名稱=[FULL_SYMBOLS_MAP.get(symbol, {}).get('name', symbol) for symbol in screener_view.index])
+            st.dataframe(
+                screener_view[['名稱', 'Combined_Rating', 'Rating_Label', 'ROE_Score', 'PE_Score', 'CF_Score', 'returnOnEquity', 'trailingPE', 'freeCashflow', 'totalCash', 'totalDebt']].rename(columns={
+                    'Combined_Rating': '綜合評級', 'Rating_Label': '評級分類', 'ROE_Score': 'ROE 分', 'PE_Score': 'PE 分', 'CF_Score': '現金流分',
+                    'returnOnEquity': 'ROE', 'trailingPE': 'PE', 'freeCashflow': '自由現金流', 'totalCash': '總現金', 'totalDebt': '總負債',
+                }),
+                use_container_width=True,
+            )
+            st.caption(f"共 {len(screener_view)} / {len(screener_table)} 檔符合條件 (點擊欄位標題可排序)")
+
     # === 結果呈現區塊 ===
     if st.session_state.get('data_ready', False):
         
         results = st.session_state['analysis_results']
-        df = results['df'].dropna() 
+        df = _as_frame(results['df'])
         company_info = results['company_info']
         currency_symbol = results['currency_symbol']
         fa_result = results['fa_result']
@@ -985,7 +3032,7 @@ def main():
         st.subheader("🧪 策略回測報告 (SMA 20/EMA 50 交叉)")
         
         # 執行回測
-        backtest_results = run_backtest(df.copy())
+        backtest_results = run_backtest(df)
         
         # 顯示回測結果
         if backtest_results.get("total_trades", 0) > 0:
@@ -1008,23 +3055,82 @@ def main():
                 
             # 資金曲線圖
             if 'capital_curve' in backtest_results:
-                fig_bt = go.Figure()
-                fig_bt.add_trace(go.Scatter(x=df.index.to_list(), y=backtest_results['capital_curve'], name='策略資金曲線', line=dict(color='#cc6600', width=2)))
-                fig_bt.add_hline(y=100000, line_dash="dash", line_color="#1e8449", annotation_text="起始資金 $100,000", annotation_position="bottom right")
-                
-                fig_bt.update_layout(
-                    title='SMA 20/EMA 50 交叉策略資金曲線',
-                    xaxis_title='交易週期',
-                    yaxis_title='賬戶價值 ($)',
-                    margin=dict(l=20, r=20, t=40, b=20),
-                    height=300
-                )
+                fig_bt = get_figure_cache().figure(
+                    ("equity", final_symbol_to_analyze, selected_period_key, frame_fingerprint(df)),
+                    lambda: create_equity_chart(df.index, backtest_results['capital_curve']))
                 st.plotly_chart(fig_bt, use_container_width=True)
                 
             st.caption("ℹ️ **策略說明:** 此回測使用 **SMA 20/EMA 50** 交叉作為**開倉/清倉**信號 (初始資金 $100,000，單次交易手續費 0.1%)。 **總回報率**越高越好，**最大回撤 (MDD)**越低越好。")
         else:
             st.info(f"回測無法執行或無交易信號：{backtest_results.get('message', '數據不足或發生錯誤。')}")
 
+        with st.expander("🎲 回測穩健性分析 (Monte Carlo / Walk-forward)"):
+            monte_carlo = monte_carlo_trades(backtest_results.get('trades', []))
+            if monte_carlo is None:
+                st.info("沒有交易紀錄，無法進行 Monte Carlo 重抽樣。")
+            else:
+                col_mc_1, col_mc_2 = st.columns([2, 1])
+                with col_mc_1:
+                    fig_mc = go.Figure(go.Histogram(x=monte_carlo['returns'], nbinsx=60, marker_color='#0077b6', opacity=0.75, name='總回報率'))
+                    fig_mc.add_vline(x=backtest_results['total_return'], line_dash="dash", line_color="#cc6600", annotation_text="實際回測")
+                    fig_mc.update_layout(title=f"{len(monte_carlo['returns']):,} 條重抽樣路徑的總回報率分佈 (%)", margin=dict(l=20, r=20, t=40, b=20), height=300)
+                    st.plotly_chart(fig_mc, use_container_width=True)
+                with col_mc_2:
+                    st.metric("虧損機率", f"{monte_carlo['loss_probability']}%")
+                    st.dataframe(monte_carlo['percentiles'], use_container_width=True)
+            
+            if st.button("執行 Walk-forward 驗證", key="walk_forward_button"):
+                with st.spinner("正在逐視窗最佳化並回測樣本外區段..."):
+                    walk_bars = len(df)
+                    st.session_state['walk_forward'] = (final_symbol_to_analyze, selected_period_key) + walk_forward_analysis(
+                        df, in_sample_bars=max(250, walk_bars // 4), out_sample_bars=max(60, walk_bars // 12))
+            
+            walk_state = st.session_state.get('walk_forward')
+            if walk_state is not None and walk_state[:2] == (final_symbol_to_analyze, selected_period_key):
+                walk_results, walk_summary = walk_state[2], walk_state[3]
+                col_wf_1, col_wf_2, col_wf_3 = st.columns(3)
+                col_wf_1.metric("樣本外串接報酬", f"{walk_summary['oos_compound_return']}%")
+                col_wf_2.metric("樣本外獲利視窗", f"{walk_summary['oos_win_windows']}/{walk_summary['windows']}")
+                col_wf_3.metric("效率 (樣本外/樣本內)", f"{walk_summary['efficiency']}")
+                st.dataframe(walk_results, use_container_width=True, hide_index=True)
+
+        with st.expander("🎯 融合策略 ATR 停利 / 停損回測 (2 ATR 風險、R:R 2:1)"):
+            refine_available = PERIOD_MAP[selected_period_key][1] != "30m"
+            use_refine = st.checkbox("以本地 30 分 K 判斷同根 K 線內停利 / 停損的先後 (僅涵蓋最近約 60 天)", value=refine_available, disabled=not refine_available, key="bracket_refine")
+            refine_bars = load_stored_bars(final_symbol_to_analyze, "30m") if use_refine and refine_available else None
+            bracket = run_bracket_backtest(df, fa_result['Combined_Rating'], refine_bars=refine_bars if refine_bars is not None and not refine_bars.empty else None,
+                                           weights=get_fusion_weights(final_symbol_to_analyze))
+            
+            if bracket is None or bracket['total_trades'] == 0:
+                st.info("沒有成交的融合信號掛單。")
+            else:
+                col_br_1, col_br_2, col_br_3, col_br_4 = st.columns(4)
+                col_br_1.metric("📊 總回報率", f"{bracket['total_return']}%")
+                col_br_2.metric("📈 勝率", f"{bracket['win_rate']}%")
+                col_br_3.metric("📉 最大回撤 (MDD)", f"{bracket['max_drawdown']}%")
+                col_br_4.metric("⚖️ 平均 R 倍數", f"{bracket['avg_r']} R")
+                st.caption(f"共 {bracket['total_trades']} 筆交易，出場原因：{bracket['exit_reasons']}；先後未知的 K 線 {bracket['ambiguous']} 根，已由 30 分 K 判斷 {bracket['refined']} 根；"
+                           "其餘保守處理：進場當根觸及停利不計 (停利從下一根才開始計)，同根同時觸及停利與停損視為停損。")
+                st.dataframe(bracket['trades'], use_container_width=True, hide_index=True)
+
+        with st.expander("🔬 均線參數掃描 (SMA 快線 × EMA 慢線 × 手續費)"):
+            col_fast, col_slow, col_rate = st.columns(3)
+            fast_range = col_fast.slider("SMA 快線範圍", 5, 100, (5, 50), step=5, key="sweep_fast_range")
+            slow_range = col_slow.slider("EMA 慢線範圍", 20, 250, (20, 200), step=10, key="sweep_slow_range")
+            sweep_rates = col_rate.multiselect("手續費假設", [0.0, 0.0005, 0.001, 0.002, 0.003], default=[0.001], key="sweep_rates")
+            
+            if st.button("執行參數掃描", key="sweep_button") and sweep_rates:
+                with st.spinner("正在並行回測所有參數組合..."):
+                    st.session_state['sweep_results'] = (final_symbol_to_analyze, selected_period_key, sweep_ma_parameters(
+                        df, range(fast_range[0], fast_range[1] + 1, 5), range(slow_range[0], slow_range[1] + 1, 10), sorted(sweep_rates)))
+            
+            sweep_state = st.session_state.get('sweep_results')
+            if sweep_state is not None and sweep_state[:2] == (final_symbol_to_analyze, selected_period_key) and not sweep_state[2].empty:
+                sweep_results = sweep_state[2]
+                heatmap_rate = st.selectbox("熱圖手續費", sorted(sweep_results['commission_rate'].unique()), key="sweep_heatmap_rate")
+                st.plotly_chart(create_sweep_heatmaps(sweep_results, heatmap_rate), use_container_width=True)
+                st.dataframe(sweep_results.sort_values('total_return', ascending=False), use_container_width=True, hide_index=True)
+
         st.markdown("---")
         
         st.subheader("🛠️ 技術指標狀態表")
@@ -1060,7 +3166,21 @@ def main():
         st.markdown("---")
         
         st.subheader(f"📊 完整技術分析圖表")
-        chart = create_comprehensive_chart(df, final_symbol_to_analyze, selected_period_key) 
+        show_signal_history = st.checkbox("在圖表上標示歷史融合信號 (買進/賣出轉折)", key="show_signal_history")
+        # 顯示區間：K 線數超過圖表點數上限時提供區間選擇，縮小區間即可看到完整解析度 (Plotly 的縮放事件不會回傳到伺服器)
+        date_range = None
+        if len(df) > CHART_MAX_POINTS:
+            first_bar, last_bar = df.index[0].to_pydatetime().replace(tzinfo=None), df.index[-1].to_pydatetime().replace(tzinfo=None)
+            view_start, view_end = st.slider("圖表顯示區間", min_value=first_bar, max_value=last_bar, value=(first_bar, last_bar), format="YYYY-MM-DD", key=f"chart_range_{final_symbol_to_analyze}_{selected_period_key}")
+            date_range = (pd.Timestamp(view_start).tz_localize(df.index.tz), pd.Timestamp(view_end).tz_localize(df.index.tz))
+        
+        # 圖表快取 key：(標的, 週期, 數據指紋, 圖表設定)；只有數據或設定改變時才重新建圖
+        fusion_weights = get_fusion_weights(final_symbol_to_analyze)
+        chart_config = (show_signal_history, fa_result['Combined_Rating'] if show_signal_history else None, tuple(sorted(fusion_weights.items())) if show_signal_history else None, date_range, CHART_MAX_POINTS)
+        chart = get_figure_cache().figure(
+            ("comprehensive", final_symbol_to_analyze, selected_period_key, frame_fingerprint(df), chart_config),
+            lambda: create_comprehensive_chart(df, final_symbol_to_analyze, selected_period_key, date_range=date_range,
+                                               signals=generate_fusion_signal_series(df, fa_result['Combined_Rating'], fusion_weights) if show_signal_history else None))
         
         st.plotly_chart(chart, use_container_width=True, key=f"plotly_chart_{final_symbol_to_analyze}_{selected_period_key}")
 
@@ -1086,6 +3206,42 @@ def main():
 
 
 if __name__ == '__main__':
+    # 離線工具：python app2.0.py --record-fixtures 2330.TW NVDA ... (錄製重播用 fixture)
+    if '--record-fixtures' in sys.argv:
+        for fixture_symbol in sys.argv[sys.argv.index('--record-fixtures') + 1:]:
+            record_replay_fixture(fixture_symbol)
+        sys.exit(0)
+    
+    # 離線工具：python app2.0.py --check-indicators [2330.TW NVDA ...] (向量化指標引擎 vs ta 庫)
+    # 一律先檢查合成數據 (不需網路，可在 CI 執行)；有指定代碼時再以實際行情 (或 MARKET_DATA_PROVIDER=replay 的 fixture) 檢查
+    if '--check-indicators' in sys.argv:
+        all_equivalent = True
+        for n_bars in SYNTHETIC_CHECK_LENGTHS:
+            for column, (is_equivalent, max_error) in check_indicator_equivalence(synthetic_ohlcv(n_bars, seed=n_bars)).items():
+                all_equivalent &= is_equivalent
+                print(f"synthetic n={n_bars} {column}: {'OK' if is_equivalent else 'MISMATCH'} (max error {max_error:.3e})")
+        for check_symbol in sys.argv[sys.argv.index('--check-indicators') + 1:]:
+            for period_key, (check_period, check_interval) in PERIOD_MAP.items():
+                check_df = get_stock_data(check_symbol, check_period, check_interval)
+                if check_df.empty: continue
+                for column, (is_equivalent, max_error) in check_indicator_equivalence(check_df).items():
+                    all_equivalent &= is_equivalent
+                    print(f"{check_symbol} {period_key} {column}: {'OK' if is_equivalent else 'MISMATCH'} (max error {max_error:.3e})")
+        sys.exit(0 if all_equivalent else 1)
+
+    # 離線工具：python app2.0.py --calibrate-fusion [US TW CRYPTO] (依資產類別校準融合權重，下次啟動 APP 時載入)
+    if '--calibrate-fusion' in sys.argv:
+        calibration_markets = sys.argv[sys.argv.index('--calibrate-fusion') + 1:] or list(FUSION_CALIBRATION_MARKETS)
+        calibration = {}
+        if os.path.exists(FUSION_WEIGHTS_PATH):
+            with open(FUSION_WEIGHTS_PATH, encoding="utf-8") as f:
+                calibration = json.load(f)
+        for market in calibration_markets:
+            calibration[market] = calibrate_fusion_weights(market)
+            print(f"{market}: {'採用' if calibration[market]['adopted'] else '維持預設'} (CV {calibration[market].get('cv_score')} vs 預設 {calibration[market].get('default_cv_score')}, 樣本 {calibration[market]['samples']})")
+        save_fusion_weights(calibration)
+        sys.exit(0)
+
     if 'last_search_symbol' not in st.session_state:
         st.session_state['last_search_symbol'] = "2330.TW"
     if 'data_ready' not in st.session_state:
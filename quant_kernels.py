@@ -0,0 +1,144 @@
+"""
+多行程計算核心：app2.0.py 的 CPU 密集工作在子行程中執行時所需的可匯入模組。
+
+Streamlit 伺服器是多執行緒的 (tornado、腳本執行緒、背景預抓排程器)，fork 會把其他執行緒當下持有的鎖一併複製到子行程而可能死結，
+因此行程池一律以 forkserver (不支援的平台改用 spawn) 啟動。這兩種方式的子行程需要以「模組名稱 + 函式名稱」重新匯入工作函式，
+而 app2.0.py 的檔名不是合法的模組名稱，所以工作函式 (均線交叉回測與參數掃描核心) 放在本模組；需要 app2.0.py 內函式的工作 (例如融合信號) 經由 run_app_function
+在子行程中以檔案路徑載入 app2.0.py (不以 __main__ 執行，不會啟動頁面)。
+"""
+import importlib.util
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+APP_MODULE_NAME = "quant_app"
+
+_app_lock = threading.Lock()
+_app_module = None
+_app_mtime = None
+
+def make_process_pool(max_workers):
+    """以 forkserver (或 spawn) 啟動的行程池；forkserver 預先載入本模組，之後每個工作行程都由它 fork 而來。"""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+def load_app(app_path):
+    """工作行程內以檔案路徑載入 app2.0.py (每個行程只載入一次，檔案修改後重新載入)。"""
+    global _app_module, _app_mtime
+    mtime = os.path.getmtime(app_path)
+    with _app_lock:
+        if _app_module is None or mtime != _app_mtime:
+            spec = importlib.util.spec_from_file_location(APP_MODULE_NAME, app_path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[APP_MODULE_NAME] = module
+            spec.loader.exec_module(module)
+            _app_module, _app_mtime = module, mtime
+        return _app_module
+
+def run_app_function(app_path, name, *args):
+    """在工作行程中呼叫 app2.0.py 的函式 name(*args)；參數與回傳值須可 pickle。"""
+    return getattr(load_app(app_path), name)(*args)
+
+# ==============================================================================
+# 均線交叉回測核心 (run_backtest / 參數掃描 / Walk-forward 共用)
+# ==============================================================================
+
+def crossover_signal(fast_ma, slow_ma):
+    """黃金交叉 = 1 (買進)、死亡交叉 = -1 (賣出)，其餘為 0；前一根均線為 NaN 時視為「未在上方」。"""
+    prev_state = np.zeros(np.shape(fast_ma), dtype=bool)
+    prev_state[1:] = fast_ma[:-1] > slow_ma[:-1]
+    current_state = fast_ma > slow_ma
+    return np.where(current_state & ~prev_state, 1, np.where(~current_state & prev_state, -1, 0))
+
+def simulate_long_only(close, signal, initial_capital=100000, commission_rate=0.001):
+    """
+    只做多的向量化回測核心：第 0 根只作為起點，之後「空手遇 1 進場、持倉遇 -1 出場」，結束時仍持倉則以最後收盤價平倉。
+    回傳 (逐 K 線資金曲線, 交易列表 [(進場位置, 出場位置, 進場價, 出場價, 報酬率)], 最終資金)。
+    """
+    # 只保留與前一個有效信號不同的轉折點，等同上述狀態機
+    signal_idx = np.flatnonzero(signal[1:] != 0) + 1
+    signal_values = signal[signal_idx]
+    is_transition = signal_values != np.concatenate(([-1], signal_values[:-1]))
+    event_idx, event_values = signal_idx[is_transition], signal_values[is_transition]
+    
+    # 資金只在進出場時改變：逐筆交易 (而非逐根 K 線) 更新，手續費與報酬的運算順序與原本逐根模擬相同
+    start_capital = initial_capital
+    event_capital = np.empty(len(event_idx))
+    trades = []
+    for k, (i, value) in enumerate(zip(event_idx, event_values)):
+        if value == 1:
+            entry_index, buy_price = i, close[i]
+            initial_capital -= initial_capital * commission_rate 
+        else:
+            profit = (close[i] - buy_price) / buy_price 
+            trades.append((entry_index, i, buy_price, close[i], profit))
+            initial_capital *= (1 + profit)
+            initial_capital -= initial_capital * commission_rate
+        event_capital[k] = initial_capital
+    
+    # 每根 K 線對應最近一次事件：持倉中淨值 = 進場後資金 × (收盤價 / 進場價)，空手時即為現金
+    last_event = np.searchsorted(event_idx, np.arange(len(close)), side='right') - 1
+    level = np.concatenate(([start_capital], event_capital))[last_event + 1]
+    in_position = np.concatenate(([False], event_values == 1))[last_event + 1]
+    entry_price = np.concatenate(([1.0], close[event_idx]))[last_event + 1]
+    capital = np.where(in_position, level * (close / entry_price), level)
+
+    # 結束時仍持倉：以最後收盤價平倉
+    if len(event_values) and event_values[-1] == 1:
+        sell_price = close[-1]
+        profit = (sell_price - buy_price) / buy_price
+        trades.append((entry_index, len(close) - 1, buy_price, sell_price, profit))
+        initial_capital *= (1 + profit)
+        initial_capital -= initial_capital * commission_rate
+        capital[-1] = initial_capital 
+    
+    return capital, trades, initial_capital
+
+def backtest_metrics(capital, trades, final_capital):
+    """總回報率 / 勝率 / 最大回撤 (%) 與交易次數 (總回報率以 100000 為基準，與 run_backtest 一致)。"""
+    total_return = ((final_capital - 100000) / 100000) * 100
+    total_trades = len(trades)
+    win_rate = (sum(1 for trade in trades if trade[4] > 0) / total_trades) * 100 if total_trades > 0 else 0
+    
+    max_value = np.maximum.accumulate(capital)
+    drawdown = (capital - max_value) / max_value
+    max_drawdown = abs(drawdown.min()) * 100
+    return {"total_return": round(total_return, 2), "win_rate": round(win_rate, 2), "max_drawdown": round(max_drawdown, 2), "total_trades": total_trades}
+
+# ==============================================================================
+# 均線參數掃描的工作端 (共享記憶體)
+# ==============================================================================
+
+SWEEP_EMPTY_METRICS = {"total_return": 0, "win_rate": 0, "max_drawdown": 0, "total_trades": 0}
+
+def sweep_jobs(matrix, jobs, initial_capital, start=0, stop=None):
+    """回測 matrix 第 start ~ stop 根 (預設整段) 上的每組 (快線列, 慢線列, 手續費)。"""
+    matrix = matrix[:, start:stop]
+    close, valid = matrix[0], matrix[1] > 0
+    results = []
+    for fast_row, slow_row, commission_rate in jobs:
+        fast_ma, slow_ma = matrix[fast_row], matrix[slow_row]
+        rows = valid & ~np.isnan(fast_ma) & ~np.isnan(slow_ma) # 等同 run_backtest 的 dropna
+        if not rows.any():
+            results.append(SWEEP_EMPTY_METRICS)
+            continue
+        signal = crossover_signal(fast_ma, slow_ma)[rows]
+        results.append(backtest_metrics(*simulate_long_only(close[rows], signal, initial_capital, commission_rate)))
+    return results
+
+def sweep_worker(shm_name, shape, jobs, initial_capital, start=0, stop=None):
+    """工作端：掛載共享記憶體中的 [收盤價, 有效列, 各 SMA..., 各 EMA...] 矩陣 (不複製)，回測分配到的參數組合。"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        return sweep_jobs(np.ndarray(shape, dtype=np.float64, buffer=shm.buf), jobs, initial_capital, start, stop)
+    finally:
+        shm.close()